@@ -1,16 +1,31 @@
 import os
 import json
+import math
+import asyncio
 import re
+import hashlib
 import uuid
+import time
 import logging
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
 from logging.handlers import RotatingFileHandler
-from flask import Flask, render_template, request, jsonify, session, Response, send_file
+from flask import Flask, render_template, request, session, Response, send_file, stream_with_context
 from dotenv import load_dotenv
-from openai import OpenAI
+import httpx
+from openai import OpenAI, DefaultHttpxClient
 import chess
+import chess.polyglot
+import chess.syzygy
+import orjson
+from cachetools import LRUCache
+from celery import Celery
+from sqlalchemy import event
 from stockfish import Stockfish as StockfishEngine
 import secrets
-from models import db, Game, LiveGame
+from models import db, Game, LiveGame, AnalysisCache, _estimate_win_chance
+import openings
 
 load_dotenv()
 
@@ -19,18 +34,29 @@ app.secret_key = os.getenv("SECRET_KEY", "dev-secret-key-change-in-production")
 
 # --- Logging setup ---
 log_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs")
-os.makedirs(log_dir, exist_ok=True)
-file_handler = RotatingFileHandler(
-    os.path.join(log_dir, "chessguardian.log"),
-    maxBytes=5 * 1024 * 1024,  # 5 MB
-    backupCount=3,
-)
-file_handler.setFormatter(logging.Formatter(
-    "[%(asctime)s] %(levelname)s %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-))
-file_handler.setLevel(logging.DEBUG)
-app.logger.addHandler(file_handler)
+LOG_FILE = os.path.join(log_dir, "chessguardian.log")
+
+
+def _attach_file_handler(logger):
+    """Attach the rotating log file once per logger, even if this module is imported again
+    (e.g. reloaded, or loaded by both gunicorn and a Celery worker in one process)."""
+    if any(getattr(h, "baseFilename", None) == LOG_FILE for h in logger.handlers):
+        return
+    os.makedirs(log_dir, exist_ok=True)
+    file_handler = RotatingFileHandler(
+        LOG_FILE,
+        maxBytes=5 * 1024 * 1024,  # 5 MB
+        backupCount=3,
+    )
+    file_handler.setFormatter(logging.Formatter(
+        "[%(asctime)s] %(levelname)s %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    ))
+    file_handler.setLevel(logging.DEBUG)
+    logger.addHandler(file_handler)
+
+
+_attach_file_handler(app.logger)
 app.logger.setLevel(logging.DEBUG)
 
 if os.getenv("DATABASE_URL"):
@@ -46,25 +72,299 @@ else:
     app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///chessguardian.db"
 
 db.init_app(app)
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+
+def ojsonify(obj, status=200):
+    """jsonify() counterpart that encodes with orjson and hands the bytes straight to the WSGI server."""
+    return Response(orjson.dumps(obj), status=status, mimetype="application/json", direct_passthrough=True)
+
+
+def history_json(history):
+    """Serialize a move list for the Text ``history`` columns."""
+    return orjson.dumps(history).decode()
+
+# Keep TLS connections to OpenAI warm across requests (HTTP/2, pooled keep-alive)
+OPENAI_HTTP_LIMITS = httpx.Limits(max_keepalive_connections=100, max_connections=200, keepalive_expiry=60)
+client = OpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    http_client=DefaultHttpxClient(http2=True, limits=OPENAI_HTTP_LIMITS),
+)
+
+# --- Background queue (run workers with: celery -A app.celery worker) ---
+CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0")
+celery = Celery(
+    __name__,
+    broker=CELERY_BROKER_URL,
+    backend=os.getenv("CELERY_RESULT_BACKEND", CELERY_BROKER_URL),
+)
+celery.conf.result_expires = 3600
 
 # --- Stockfish setup ---
 STOCKFISH_PATH = os.getenv("STOCKFISH_PATH", "/usr/games/stockfish" if os.path.exists("/usr/games/stockfish") else "/opt/homebrew/bin/stockfish")
 STOCKFISH_SKILL = int(os.getenv("STOCKFISH_SKILL", "10"))  # 0-20, default 10 (~1500 Elo)
 STOCKFISH_DEPTH = int(os.getenv("STOCKFISH_DEPTH", "12"))
 
+STOCKFISH_THREADS = int(os.getenv("STOCKFISH_THREADS", "1"))
+STOCKFISH_HASH = int(os.getenv("STOCKFISH_HASH", "128"))  # MB per engine
+STOCKFISH_POOL_SIZE = int(os.getenv("STOCKFISH_POOL_SIZE", "2"))
+STOCKFISH_POOL_TIMEOUT = float(os.getenv("STOCKFISH_POOL_TIMEOUT", "30"))  # seconds to wait for a free engine
+
+
 def get_stockfish():
-    """Create a fresh Stockfish instance."""
-    sf = StockfishEngine(path=STOCKFISH_PATH, depth=STOCKFISH_DEPTH)
-    sf.update_engine_parameters({"Skill Level": STOCKFISH_SKILL})
+    """Create a fresh, fully configured Stockfish instance.
+    Evaluations are reported from White's perspective."""
+    sf = StockfishEngine(path=STOCKFISH_PATH, depth=STOCKFISH_DEPTH, turn_perspective=False)
+    sf.update_engine_parameters({
+        "Threads": STOCKFISH_THREADS,
+        "Hash": STOCKFISH_HASH,
+        "Skill Level": STOCKFISH_SKILL,
+    })
     return sf
 
+
+class EnginePoolBusy(RuntimeError):
+    """No pooled engine became free within the pool's timeout."""
+
+
+class StockfishPool:
+    """Bounded pool of long-lived Stockfish processes.
+
+    Engines are spawned lazily up to ``size`` and handed out one request at a
+    time, so the hot path is just ``set_fen_position`` + ``get_best_move`` on a
+    warm engine. An engine that raises inside ``acquire()`` is discarded, which
+    frees its slot for a fresh one. Callers wait at most ``timeout`` seconds
+    for an engine, then get EnginePoolBusy.
+    """
+
+    def __init__(self, size, timeout=None):
+        self.size = max(1, size)
+        self.timeout = timeout
+        self._idle = []
+        self._spawned = 0
+        self._available = threading.Condition()
+
+    def _checkout(self):
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        with self._available:
+            while not self._idle and self._spawned >= self.size:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise EnginePoolBusy("No Stockfish engine available")
+                self._available.wait(remaining)
+            if self._idle:
+                return self._idle.pop()
+            self._spawned += 1
+        try:
+            return get_stockfish()
+        except Exception:
+            self._free_slot()
+            raise
+
+    def _free_slot(self):
+        with self._available:
+            self._spawned -= 1
+            self._available.notify()
+
+    def _discard(self, sf):
+        self._free_slot()
+        try:
+            sf.send_quit_command()
+        except Exception:
+            pass
+
+    @contextmanager
+    def acquire(self):
+        sf = self._checkout()
+        try:
+            yield sf
+        except Exception:
+            self._discard(sf)
+            raise
+        else:
+            with self._available:
+                self._idle.append(sf)
+                self._available.notify()
+
+
+engine_pool = StockfishPool(STOCKFISH_POOL_SIZE, STOCKFISH_POOL_TIMEOUT)
+
+
+@app.errorhandler(EnginePoolBusy)
+def engine_pool_busy(e):
+    return ojsonify({"error": "Stockfish is busy, retry shortly"}), 503, {"Retry-After": "2"}
+
+# --- Opening book / endgame tablebase (optional, memory-mapped) ---
+OPENING_BOOK_PATH = os.getenv("OPENING_BOOK_PATH", "data/book.bin")
+SYZYGY_PATH = os.getenv("SYZYGY_PATH", "data/syzygy")
+SYZYGY_MAX_PIECES = int(os.getenv("SYZYGY_MAX_PIECES", "5"))
+
+opening_book = chess.polyglot.open_reader(OPENING_BOOK_PATH) if os.path.isfile(OPENING_BOOK_PATH) else None
+tablebase = chess.syzygy.open_tablebase(SYZYGY_PATH) if os.path.isdir(SYZYGY_PATH) else None
+
+
+def _tablebase_move(board):
+    """Best move by Syzygy WDL/DTZ: win fastest, otherwise hold the draw or resist longest.
+    Returns None if a needed table is missing."""
+    best_move, best_key = None, None
+    for move in board.legal_moves:
+        board.push(move)
+        try:
+            # Scores are from the opponent's side after our move, so lower is better
+            key = (tablebase.probe_wdl(board), -tablebase.probe_dtz(board))
+        except KeyError:
+            return None
+        finally:
+            board.pop()
+        if best_key is None or key < best_key:
+            best_move, best_key = move, key
+    return best_move
+
+
+def instant_move(board):
+    """A book or tablebase move for the position, or None to fall through to Stockfish."""
+    if opening_book:
+        try:
+            return opening_book.weighted_choice(board).move
+        except IndexError:
+            pass
+    if tablebase and chess.popcount(board.occupied) <= SYZYGY_MAX_PIECES:
+        return _tablebase_move(board)
+    return None
+
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+# Smaller model for early-opening positions and {"mode": "quick"} requests;
+# set OPENAI_FAST_MODEL to an empty string to always use OPENAI_MODEL
+OPENAI_FAST_MODEL = os.getenv("OPENAI_FAST_MODEL", "gpt-4.1-nano")
+FAST_MODEL_MAX_PLY = int(os.getenv("FAST_MODEL_MAX_PLY", "12"))
+# Whitespace-separated tokens of move history kept in prompts (move numbers count)
+PROMPT_HISTORY_TOKENS = int(os.getenv("PROMPT_HISTORY_TOKENS", "20"))
+_NOTATION_RE = re.compile(r"\(([^()]+)\)\s*$")
+# Cheap shape check run before python-chess parses a client-supplied FEN
+_FEN_RE = re.compile(r"^([rnbqkpRNBQKP1-8]+/){7}[rnbqkpRNBQKP1-8]+ [wb] (-|[KQkq]{1,4}) (-|[a-h][36])( \d+ \d+)?$")
+
+
+@lru_cache(maxsize=4096)
+def _parse_fen(fen):
+    # Shared instance: never mutate, hand out copies
+    return chess.Board(fen)
+
+
+def parse_fen(fen):
+    """Return a chess.Board for a client-supplied FEN, or None if it is invalid.
+    Hot positions are parsed once; each caller gets its own copy."""
+    if not isinstance(fen, str) or not _FEN_RE.match(fen):
+        return None
+    try:
+        return _parse_fen(fen).copy(stack=False)
+    except ValueError:
+        return None
+# Positions Stockfish scores beyond this (centipawns) are answered without OpenAI
+DECISIVE_EVAL_CP = int(os.getenv("DECISIVE_EVAL_CP", "500"))
+
+# --- Response caches (per worker) ---
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "10000"))
+_move_cache = LRUCache(maxsize=RESPONSE_CACHE_SIZE)
+_analysis_cache = LRUCache(maxsize=RESPONSE_CACHE_SIZE)
+_cache_lock = threading.Lock()
+
+
+def normalize_fen(fen):
+    """Drop the halfmove/fullmove counters so transposed positions share a key."""
+    return " ".join(fen.split()[:4])
+
+
+def move_cache_fen(fen):
+    """normalize_fen plus the halfmove clock, which Stockfish's choice depends on
+    (fifty-move rule). Clocks past 100 plies all mean a draw can be claimed."""
+    fields = fen.split()
+    halfmove = int(fields[4]) if len(fields) > 4 and fields[4].isdigit() else 0
+    return f"{' '.join(fields[:4])} {min(halfmove, 100)}"
+
+
+def cache_get(cache, key):
+    with _cache_lock:
+        return cache.get(key)
+
+
+def cache_put(cache, key, value):
+    with _cache_lock:
+        cache[key] = value
+
+
+def prompt_history(move_history):
+    """The tail of the move history that actually goes into the prompt."""
+    return " ".join(move_history.split()[-PROMPT_HISTORY_TOKENS:])
+
+
+def analysis_cache_key(fen, move_history, model):
+    """Key an analysis by everything the model sees: position, prompt history and model."""
+    raw = f"{normalize_fen(fen)}|{prompt_history(move_history)}|{model}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def analysis_cache_get(key):
+    """Look an analysis up in this process's LRU, then in the shared table."""
+    payload = cache_get(_analysis_cache, key)
+    if payload is not None:
+        return payload
+    with app.app_context():
+        row = db.session.get(AnalysisCache, key)
+    if row is None:
+        return None
+    payload = orjson.loads(row.analysis)
+    cache_put(_analysis_cache, key, payload)
+    return payload
+
+
+def analysis_cache_put(key, payload):
+    cache_put(_analysis_cache, key, payload)
+    with app.app_context():
+        try:
+            db.session.merge(AnalysisCache(key=key, analysis=orjson.dumps(payload).decode()))
+            db.session.commit()
+        except Exception as e:
+            # Another worker may have stored the same key first
+            db.session.rollback()
+            app.logger.warning("Could not persist analysis cache entry: %s", e)
+
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",  # 256 MB
+    "PRAGMA cache_size=-64000",  # ~64 MB page cache
+)
+
+
+def _set_sqlite_pragmas(dbapi_conn, _record):
+    """WAL lets readers run alongside the writer and, with synchronous=NORMAL,
+    commits no longer fsync twice. The rest keep temp tables and hot pages in memory."""
+    cursor = dbapi_conn.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
+
 with app.app_context():
+    if app.config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite"):
+        event.listen(db.engine, "connect", _set_sqlite_pragmas)
     db.create_all()
     # Migrate: add columns if missing from older DB
     with db.engine.connect() as conn:
+        for col, col_def in [
+            ("name", "VARCHAR(100) DEFAULT ''"),
+            ("batch_id", "VARCHAR(64)"),
+            ("batch_status", "VARCHAR(20)"),
+            ("annotations", "TEXT"),
+            ("created_at", "DATETIME"),
+        ]:
+            try:
+                conn.execute(db.text(f"ALTER TABLE game ADD COLUMN {col} {col_def}"))
+                conn.commit()
+            except Exception:
+                pass
         try:
-            conn.execute(db.text("ALTER TABLE game ADD COLUMN name VARCHAR(100) DEFAULT ''"))
+            conn.execute(db.text("UPDATE game SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL"))
             conn.commit()
         except Exception:
             pass
@@ -78,6 +378,12 @@ with app.app_context():
                 conn.commit()
             except Exception:
                 pass
+        try:
+            conn.execute(db.text("CREATE INDEX IF NOT EXISTS ix_game_session_id_id ON game (session_id, id)"))
+            conn.execute(db.text("CREATE INDEX IF NOT EXISTS ix_game_session_created ON game (session_id, created_at)"))
+            conn.commit()
+        except Exception:
+            pass
         try:
             conn.execute(db.text("SELECT 1 FROM live_game LIMIT 1"))
         except Exception:
@@ -101,41 +407,161 @@ SYSTEM_PROMPT = """You are an expert chess analyst. When given a chess position
 Rules:
 - bestMove: Include piece name, origin square, destination square, and standard notation. Examples: "Knight from g1 to f3 (Nf3)", "Pawn from e2 to e4 (e4)", "King castles kingside (O-O)"
 - winChance: Integer 0-100 representing White's winning probability. 50 = equal, 100 = White winning, 0 = Black winning.
-- Always recommend a move from the legal moves list provided.
+- Always recommend a legal move. If a legal moves list is provided it is in UCI notation (e.g. g1f3, e7e8q); describe your choice as above, with standard algebraic notation in the parentheses.
 - Return ONLY the JSON object, nothing else."""
 
 
+def describe_move(board, move):
+    """Describe a move the way SYSTEM_PROMPT asks the model to, e.g. "Knight from g1 to f3 (Nf3)"."""
+    san = board.san(move)
+    if board.is_castling(move):
+        side = "kingside" if board.is_kingside_castling(move) else "queenside"
+        return f"King castles {side} ({san})"
+    piece = chess.piece_name(board.piece_type_at(move.from_square)).capitalize()
+    return f"{piece} from {chess.square_name(move.from_square)} to {chess.square_name(move.to_square)} ({san})"
+
+
+def pick_model(board, mode=None):
+    """Route opening positions and quick-mode requests to the fast model tier."""
+    if not OPENAI_FAST_MODEL:
+        return OPENAI_MODEL
+    if mode == "quick" or board.ply() < FAST_MODEL_MAX_PLY:
+        return OPENAI_FAST_MODEL
+    return OPENAI_MODEL
+
+
+def eval_to_win_chance(cp=None, mate=None):
+    """Map a White-POV Stockfish score to White's win chance (0-100)."""
+    if mate is not None:
+        return 100 if mate > 0 else 0
+    return max(0, min(100, round(50 + 50 * math.tanh(cp / 600))))
+
+
+def _engine_top_move(fen):
+    """Top move and White-POV score from a pooled engine, in one STOCKFISH_DEPTH search.
+    Pooled engines run at Skill Level STOCKFISH_SKILL, so this is not a full-strength probe."""
+    with engine_pool.acquire() as sf:
+        sf.set_fen_position(fen)
+        top = sf.get_top_moves(1)
+    return top[0] if top else None
+
+
+def _local_analysis(board, move, top=None):
+    """Build an /api/analyze payload without calling OpenAI.
+    `top` is the engine's line for the position, or None for a forced reply."""
+    side_to_move = "White" if board.turn == chess.WHITE else "Black"
+    best_move = describe_move(board, move)
+
+    if top is None:
+        explanation = f"This is the only legal move for {side_to_move}."
+        evaluation = "Forced reply"
+        win_chance = _estimate_win_chance(board)
+    elif top["Mate"] is not None:
+        mate = top["Mate"]
+        winner = "White" if mate > 0 else "Black"
+        explanation = f"Stockfish finds a forced mate: {winner} mates in {abs(mate)}."
+        evaluation = f"{winner} is winning (mate in {abs(mate)})"
+        win_chance = eval_to_win_chance(mate=mate)
+    elif abs(top["Centipawn"]) <= DECISIVE_EVAL_CP:
+        cp = top["Centipawn"]
+        leader = "White" if cp > 0 else "Black"
+        explanation = f"{best_move} is Stockfish's top choice in this position."
+        evaluation = f"Roughly equal ({cp / 100:+.2f})" if abs(cp) < 50 else f"{leader} is better ({cp / 100:+.2f})"
+        win_chance = eval_to_win_chance(cp=cp)
+    else:
+        cp = top["Centipawn"]
+        leader = "White" if cp > 0 else "Black"
+        explanation = f"Stockfish rates this position as decisive for {leader}; {best_move} keeps the advantage on track."
+        evaluation = f"{leader} is winning ({cp / 100:+.2f})"
+        win_chance = eval_to_win_chance(cp=cp)
+
+    analysis = f"**Best Move:** {best_move}\n\n**Explanation:** {explanation}\n\n**Evaluation:** {evaluation}"
+    return {
+        "analysis": analysis,
+        "bestMove": best_move,
+        "explanation": explanation,
+        "evaluation": evaluation,
+        "game_over": False,
+        "status": "ok",
+        "winChance": win_chance,
+    }
+
+
+def _engine_analysis(board, fen):
+    """/api/analyze payload from the engine's top line, or None if Stockfish fails."""
+    try:
+        top = _engine_top_move(fen)
+    except Exception as e:
+        app.logger.warning("Stockfish fallback failed: %s", str(e))
+        return None
+    if not top:
+        return None
+    return _local_analysis(board, chess.Move.from_uci(top["Move"]), top)
+
+
+def _book_analysis(board):
+    """Canned /api/analyze payload for a known opening position, or None."""
+    entry = openings.lookup(board)
+    if not entry:
+        return None
+    eco, name, move, plan = entry
+    best_move = describe_move(board, move)
+    evaluation = f"{name} ({eco})"
+    return {
+        "analysis": f"**Best Move:** {best_move}\n\n**Explanation:** {plan}\n\n**Evaluation:** {evaluation}",
+        "bestMove": best_move,
+        "explanation": plan,
+        "evaluation": evaluation,
+        "game_over": False,
+        "status": "ok",
+        "winChance": _estimate_win_chance(board),
+    }
+
+
 @app.route("/")
 def index():
     return render_template("index.html")
 
 
 @app.route("/api/move", methods=["POST"])
-def get_ai_move():
+async def get_ai_move():
     """Use Stockfish to pick the best move for the current position."""
     data = request.get_json()
     if not data:
-        return jsonify({"error": "No data provided"}), 400
+        return ojsonify({"error": "No data provided"}), 400
 
     fen = data.get("fen")
     if not fen:
-        return jsonify({"error": "FEN is required"}), 400
+        return ojsonify({"error": "FEN is required"}), 400
 
-    try:
-        board = chess.Board(fen)
-    except ValueError:
-        return jsonify({"error": "Invalid FEN position"}), 400
+    board = parse_fen(fen)
+    if board is None:
+        return ojsonify({"error": "Invalid FEN position"}), 400
 
     if board.is_game_over():
-        return jsonify({"error": "Game is already over"}), 400
+        return ojsonify({"error": "Game is already over"}), 400
+
+    cache_key = (move_cache_fen(fen), STOCKFISH_SKILL, STOCKFISH_DEPTH)
+    cached = cache_get(_move_cache, cache_key)
+    if cached:
+        return ojsonify(cached)
+
+    move = instant_move(board)
+    if move:
+        app.logger.info("Book/tablebase move: %s for FEN: %s", move.uci(), fen)
+        return ojsonify({"move": move.uci(), "san": board.san(move)})
+
+    if data.get("async"):
+        task = run_stockfish.delay(fen)
+        return ojsonify({"task_id": task.id}), 202
 
     try:
-        sf = get_stockfish()
-        sf.set_fen_position(fen)
-        best_move_uci = sf.get_best_move()
+        with engine_pool.acquire() as sf:
+            sf.set_fen_position(fen)
+            best_move_uci = await asyncio.to_thread(sf.get_best_move)
 
         if not best_move_uci:
-            return jsonify({"error": "Stockfish could not find a move"}), 500
+            return ojsonify({"error": "Stockfish could not find a move"}), 500
 
         # Convert UCI to SAN for display
         move = chess.Move.from_uci(best_move_uci)
@@ -143,94 +569,154 @@ def get_ai_move():
 
         app.logger.info("Stockfish move: %s (%s) for FEN: %s", san, best_move_uci, fen)
 
-        return jsonify({
+        payload = {
             "move": best_move_uci,
             "san": san,
-        })
+        }
+        cache_put(_move_cache, cache_key, payload)
+        return ojsonify(payload)
+    except EnginePoolBusy:
+        raise
     except Exception as e:
         app.logger.error("Stockfish error: %s", str(e), exc_info=True)
-        return jsonify({"error": f"Stockfish error: {str(e)}"}), 500
-
-
-@app.route("/api/analyze", methods=["POST"])
-def analyze():
-    data = request.get_json()
-    if not data:
-        return jsonify({"error": "No data provided"}), 400
+        return ojsonify({"error": f"Stockfish error: {str(e)}"}), 500
+
+
+def _game_over_analysis(board):
+    """Return the /api/analyze payload for a finished game, or None if play continues."""
+    outcome = board.outcome()
+    if outcome is None:
+        return None
+    result = outcome.result()
+    if outcome.termination == chess.Termination.CHECKMATE:
+        winner = "White" if outcome.winner == chess.WHITE else "Black"
+        win_chance = 100 if winner == "White" else 0
+        return {
+            "analysis": f"**Checkmate!** {winner} wins.",
+            "game_over": True,
+            "status": f"Checkmate - {winner} wins ({result})",
+            "winChance": win_chance
+        }
+    if outcome.termination == chess.Termination.STALEMATE:
+        return {
+            "analysis": "**Stalemate!** The game is a draw.",
+            "game_over": True,
+            "status": f"Stalemate - Draw ({result})",
+            "winChance": 50
+        }
+    if outcome.termination == chess.Termination.INSUFFICIENT_MATERIAL:
+        return {
+            "analysis": "**Draw by insufficient material.**",
+            "game_over": True,
+            "status": f"Insufficient material - Draw ({result})",
+            "winChance": 50
+        }
+    return {
+        "analysis": f"**Game over.** Result: {result}",
+        "game_over": True,
+        "status": f"Game over ({result})",
+        "winChance": 50
+    }
+
+
+def _quick_analysis(board, fen, move_history, model):
+    """Payload for anything answerable without OpenAI: finished games, cache
+    hits, book openings and positions Stockfish already decides. Returns None otherwise."""
+    payload = _game_over_analysis(board)
+    if payload:
+        return payload
+    cache_key = analysis_cache_key(fen, move_history, model)
+    payload = analysis_cache_get(cache_key)
+    if payload:
+        return payload
+    payload = _route_locally(board, fen)
+    if payload:
+        analysis_cache_put(cache_key, payload)
+    return payload
+
+
+def _route_locally(board, fen):
+    """Answer forced replies, book openings and decided positions without OpenAI.
+    Returns an /api/analyze payload, or None when the position needs the LLM."""
+    if board.legal_moves.count() == 1:
+        return _local_analysis(board, next(iter(board.legal_moves)))
+    book = _book_analysis(board)
+    if book:
+        return book
+    try:
+        top = _engine_top_move(fen)
+    except Exception as e:
+        app.logger.warning("Stockfish routing skipped: %s", str(e))
+        return None
+    if top and (top["Mate"] is not None or abs(top["Centipawn"]) > DECISIVE_EVAL_CP):
+        return _local_analysis(board, chess.Move.from_uci(top["Move"]), top)
+    return None
 
-    fen = data.get("fen")
-    last_move = data.get("last_move", "")
-    move_history = data.get("move_history", "")
 
-    if not fen:
-        return jsonify({"error": "FEN is required"}), 400
-
-    # Validate FEN with python-chess
+def _build_user_message(board, fen, move_history, with_legal_moves=False):
+    """Build the analysis prompt. The legal-move list is left out unless a
+    previous reply suggested an illegal move, and history is cut to its tail."""
+    side_to_move = "White" if board.turn == chess.WHITE else "Black"
+    parts = [
+        f"Position (FEN): {fen}",
+        f"It is {side_to_move}'s turn to move. Suggest the best move for {side_to_move}.",
+    ]
+    if with_legal_moves:
+        parts.append(f"Legal moves: {' '.join(m.uci() for m in board.legal_moves)}")
+        parts.append("IMPORTANT: You MUST recommend one of the legal moves listed above. Do not suggest any move that is not in this list.")
+    if move_history:
+        parts.append(f"Move history: {prompt_history(move_history)}")
+    return "\n".join(parts)
+
+
+def _completion_request(user_message, model=OPENAI_MODEL):
+    """Keyword arguments for one analysis chat completion."""
+    return {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": user_message}
+        ],
+        "max_tokens": 500,
+        "response_format": {"type": "json_object"},
+    }
+
+
+def suggested_move(board, best_move):
+    """Pull the move out of a "Knight from g1 to f3 (Nf3)" description.
+    Returns the legal chess.Move it names, or None."""
+    match = _NOTATION_RE.search(best_move or "")
+    notation = (match.group(1) if match else best_move or "").strip()
+    try:
+        return board.parse_san(notation)
+    except ValueError:
+        pass
     try:
-        board = chess.Board(fen)
+        move = chess.Move.from_uci(notation)
     except ValueError:
-        return jsonify({"error": "Invalid FEN position"}), 400
+        return None
+    return move if board.is_legal(move) else None
 
-    # Check game-over states
-    if board.is_game_over():
-        result = board.result()
-        if board.is_checkmate():
-            winner = "Black" if board.turn == chess.WHITE else "White"
-            win_chance = 100 if winner == "White" else 0
-            return jsonify({
-                "analysis": f"**Checkmate!** {winner} wins.",
-                "game_over": True,
-                "status": f"Checkmate - {winner} wins ({result})",
-                "winChance": win_chance
-            })
-        if board.is_stalemate():
-            return jsonify({
-                "analysis": "**Stalemate!** The game is a draw.",
-                "game_over": True,
-                "status": f"Stalemate - Draw ({result})",
-                "winChance": 50
-            })
-        if board.is_insufficient_material():
-            return jsonify({
-                "analysis": "**Draw by insufficient material.**",
-                "game_over": True,
-                "status": f"Insufficient material - Draw ({result})",
-                "winChance": 50
-            })
-        return jsonify({
-            "analysis": f"**Game over.** Result: {result}",
-            "game_over": True,
-            "status": f"Game over ({result})",
-            "winChance": 50
-        })
 
-    # Build the prompt
-    side_to_move = "White" if board.turn == chess.WHITE else "Black"
-    legal_moves = " ".join(board.san(m) for m in board.legal_moves)
-    user_message = f"Position (FEN): {fen}\nIt is {side_to_move}'s turn to move. Suggest the best move for {side_to_move}."
-    user_message += f"\nLegal moves: {legal_moves}"
-    user_message += "\nIMPORTANT: You MUST recommend one of the legal moves listed above. Do not suggest any move that is not in this list."
-    if move_history:
-        user_message += f"\nMove history: {move_history}"
-    if last_move:
-        user_message += f"\nLast move played: {last_move}"
+class IllegalSuggestion(ValueError):
+    """Every model answer named an illegal move and Stockfish could not stand in."""
 
-    app.logger.info("=== OpenAI Request ===")
-    app.logger.info("FEN: %s", fen)
-    app.logger.info("Side to move: %s", side_to_move)
-    app.logger.info("User message:\n%s", user_message)
 
-    # Call OpenAI
-    try:
-        response = client.chat.completions.create(
-            model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": user_message}
-            ],
-            max_tokens=500,
-            response_format={"type": "json_object"},
-        )
+def _complete_analysis(board, fen, move_history, model=OPENAI_MODEL, attempts=(False, True)):
+    """Synchronous OpenAI analysis. Each entry of `attempts` says whether to list
+    legal moves; later attempts only run if the previous suggestion was illegal.
+    If every attempt is illegal the answer comes from Stockfish; raises
+    IllegalSuggestion when that fails too, so an illegal suggestion is never
+    returned (or cached). Raises json.JSONDecodeError on an unparseable reply."""
+    for with_legal_moves in attempts:
+        user_message = _build_user_message(board, fen, move_history, with_legal_moves)
+
+        app.logger.info("=== OpenAI Request ===")
+        app.logger.info("FEN: %s", fen)
+        app.logger.info("Side to move: %s", "White" if board.turn == chess.WHITE else "Black")
+        app.logger.info("User message:\n%s", user_message)
+
+        response = client.chat.completions.create(**_completion_request(user_message, model))
         raw = response.choices[0].message.content.strip()
 
         app.logger.info("=== OpenAI Response ===")
@@ -240,154 +726,589 @@ def analyze():
                         response.usage.completion_tokens,
                         response.usage.total_tokens)
         app.logger.info("Raw response:\n%s", raw)
-
         if not raw:
-            return jsonify({"error": "AI returned empty response"}), 500
+            raise ValueError("AI returned empty response")
+
+        payload = _parse_analysis(raw)
+        if suggested_move(board, payload["bestMove"]):
+            return payload
+        app.logger.warning("Model suggested an illegal move: %s", payload["bestMove"])
+    payload = _engine_analysis(board, fen)
+    if payload is None:
+        raise IllegalSuggestion("AI suggested an illegal move")
+    app.logger.info("Answered by Stockfish after illegal suggestions — bestMove: %s", payload["bestMove"])
+    return payload
+
+
+def _parse_analysis(raw):
+    """Turn the model's JSON reply into an /api/analyze payload. Raises json.JSONDecodeError."""
+    result = json.loads(raw)
+    best_move = result.get("bestMove", "")
+    explanation = result.get("explanation", "")
+    evaluation = result.get("evaluation", "")
+    win_chance = result.get("winChance", 50)
+    win_chance = max(0, min(100, int(win_chance)))
+
+    analysis = f"**Best Move:** {best_move}\n\n**Explanation:** {explanation}\n\n**Evaluation:** {evaluation}"
+    return {
+        "analysis": analysis,
+        "bestMove": best_move,
+        "explanation": explanation,
+        "evaluation": evaluation,
+        "game_over": False,
+        "status": "ok",
+        "winChance": win_chance
+    }
 
-        result = json.loads(raw)
-        best_move = result.get("bestMove", "")
-        explanation = result.get("explanation", "")
-        evaluation = result.get("evaluation", "")
-        win_chance = result.get("winChance", 50)
-        win_chance = max(0, min(100, int(win_chance)))
 
-        analysis = f"**Best Move:** {best_move}\n\n**Explanation:** {explanation}\n\n**Evaluation:** {evaluation}"
+def _parse_analyze_request(data):
+    """Validate an analyze request body. Returns (board, None) or (None, error_response)."""
+    if not data:
+        return None, (ojsonify({"error": "No data provided"}), 400)
+
+    fen = data.get("fen")
+    if not fen:
+        return None, (ojsonify({"error": "FEN is required"}), 400)
+
+    board = parse_fen(fen)
+    if board is None:
+        return None, (ojsonify({"error": "Invalid FEN position"}), 400)
+    return board, None
 
+
+@app.route("/api/analyze", methods=["POST"])
+async def analyze():
+    data = request.get_json()
+    board, error = _parse_analyze_request(data)
+    if error:
+        return error
+
+    fen = data["fen"]
+    move_history = data.get("move_history", "")
+
+    game_over = _game_over_analysis(board)
+    if game_over:
+        return ojsonify(game_over)
+
+    model = pick_model(board, data.get("mode"))
+    cache_key = analysis_cache_key(fen, move_history, model)
+    cached = await asyncio.to_thread(analysis_cache_get, cache_key)
+    if cached:
+        app.logger.info("Analysis cache hit for FEN: %s", fen)
+        return ojsonify(cached)
+
+    if data.get("async"):
+        task = run_analysis.delay(fen, move_history, model)
+        return ojsonify({"task_id": task.id}), 202
+
+    # Route decided positions to Stockfish and skip the LLM
+    local = await asyncio.to_thread(_route_locally, board, fen)
+    if local:
+        app.logger.info("Answered locally — bestMove: %s, winChance: %d", local["bestMove"], local["winChance"])
+        await asyncio.to_thread(analysis_cache_put, cache_key, local)
+        return ojsonify(local)
+
+    # Call OpenAI with the compressed prompt; retry once with legal moves listed
+    # if the suggestion does not parse to a legal move. Flask runs each async view
+    # on a fresh event loop, so a shared async client's pooled connections would
+    # outlive their loop; the pooled sync client is called from a worker thread instead
+    try:
+        payload = await asyncio.to_thread(_complete_analysis, board, fen, move_history, model)
     except json.JSONDecodeError as e:
-        app.logger.error("JSON parse error: %s\nRaw: %s", str(e), raw, exc_info=True)
-        return jsonify({"error": "AI returned invalid JSON"}), 500
+        app.logger.error("JSON parse error: %s", str(e), exc_info=True)
+        return ojsonify({"error": "AI returned invalid JSON"}), 500
+    except IllegalSuggestion as e:
+        return ojsonify({"error": str(e)}), 502
     except Exception as e:
         app.logger.error("OpenAI API error: %s", str(e), exc_info=True)
-        return jsonify({"error": f"AI analysis failed: {str(e)}"}), 500
+        return ojsonify({"error": f"AI analysis failed: {str(e)}"}), 500
 
-    app.logger.info("Parsed — bestMove: %s, winChance: %d", best_move, win_chance)
+    app.logger.info("Parsed — bestMove: %s, winChance: %d", payload["bestMove"], payload["winChance"])
 
-    return jsonify({
-        "analysis": analysis,
-        "bestMove": best_move,
-        "explanation": explanation,
-        "evaluation": evaluation,
-        "game_over": False,
-        "status": "ok",
-        "winChance": win_chance
-    })
+    await asyncio.to_thread(analysis_cache_put, cache_key, payload)
+    return ojsonify(payload)
 
 
-@app.route("/api/games/save", methods=["POST"])
-def save_game():
+def _sse(data, event=None):
+    """Format one server-sent event frame carrying a JSON payload."""
+    frame = f"event: {event}\n" if event else ""
+    return frame + f"data: {orjson.dumps(data).decode()}\n\n"
+
+
+@app.route("/api/analyze/stream", methods=["POST"])
+def analyze_stream():
+    """Same as /api/analyze, but streams the model's output as server-sent events.
+
+    Emits ``data: {"delta": ...}`` frames while the completion is generated,
+    then one ``event: done`` frame carrying the usual /api/analyze payload
+    (or ``event: error`` on failure).
+    """
     data = request.get_json()
-    if not data:
-        return jsonify({"error": "No data provided"}), 400
+    board, error = _parse_analyze_request(data)
+    if error:
+        return error
+
+    fen = data["fen"]
+    move_history = data.get("move_history", "")
+    model = pick_model(board, data.get("mode"))
+    cache_key = analysis_cache_key(fen, move_history, model)
+
+    def events():
+        quick = _quick_analysis(board, fen, move_history, model)
+        if quick:
+            yield _sse(quick, event="done")
+            return
+
+        user_message = _build_user_message(board, fen, move_history)
+        parts = []
+        try:
+            stream = client.chat.completions.create(**_completion_request(user_message, model), stream=True)
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    parts.append(delta)
+                    yield _sse({"delta": delta})
+            payload = _parse_analysis("".join(parts))
+            if not suggested_move(board, payload["bestMove"]):
+                app.logger.warning("Model suggested an illegal move: %s", payload["bestMove"])
+                payload = _complete_analysis(board, fen, move_history, model, attempts=(True,))
+        except json.JSONDecodeError as e:
+            app.logger.error("JSON parse error: %s\nRaw: %s", str(e), "".join(parts), exc_info=True)
+            yield _sse({"error": "AI returned invalid JSON"}, event="error")
+            return
+        except Exception as e:
+            app.logger.error("OpenAI API error: %s", str(e), exc_info=True)
+            yield _sse({"error": f"AI analysis failed: {str(e)}"}, event="error")
+            return
+
+        app.logger.info("Streamed — bestMove: %s, winChance: %d", payload["bestMove"], payload["winChance"])
+        analysis_cache_put(cache_key, payload)
+        yield _sse(payload, event="done")
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _validate_save(data):
+    """Check one save payload. Returns (fields, None) or (None, error_message)."""
+    if not isinstance(data, dict) or not data:
+        return None, "No data provided"
 
     history = data.get("history", [])
     if not history:
-        return jsonify({"error": "No moves to save"}), 400
+        return None, "No moves to save"
 
     name = data.get("name", "").strip()
     if not name:
-        return jsonify({"error": "Game name is required"}), 400
+        return None, "Game name is required"
+
+    return {
+        "name": name,
+        "date": data.get("date", ""),
+        "moves": data.get("moves", ""),
+        "history": history_json(history),
+        "move_count": data.get("moveCount", len(history)),
+    }, None
 
-    now = data.get("date", "")
-    moves = data.get("moves", "")
-    move_count = data.get("moveCount", len(history))
-    history_json = json.dumps(history)
+
+@app.route("/api/games/save", methods=["POST"])
+def save_game():
+    data = request.get_json()
+    fields, error = _validate_save(data)
+    if error:
+        return ojsonify({"error": error}), 400
 
     # Overwrite if id provided and belongs to this session
     game_id = data.get("id")
     if game_id:
         game = Game.query.filter_by(id=game_id, session_id=session["session_id"]).first()
         if game:
-            game.name = name
-            game.date = now
-            game.moves = moves
-            game.history = history_json
-            game.move_count = move_count
+            for key, value in fields.items():
+                setattr(game, key, value)
             db.session.commit()
-            return jsonify(game.to_dict())
+            return ojsonify(game.to_dict())
 
-    game = Game(
-        session_id=session["session_id"],
-        name=name,
-        date=now,
-        moves=moves,
-        history=history_json,
-        move_count=move_count,
-    )
+    game = Game(session_id=session["session_id"], **fields)
     db.session.add(game)
     db.session.commit()
 
-    return jsonify(game.to_dict()), 201
+    return ojsonify(game.to_dict()), 201
+
+
+@app.route("/api/games/save_bulk", methods=["POST"])
+def save_games_bulk():
+    """Save (or overwrite, by id) a JSON array of games in a single transaction."""
+    data = request.get_json()
+    if not isinstance(data, list) or len(data) == 0:
+        return ojsonify({"error": "Expected a non-empty array of games"}), 400
+
+    checked = []
+    for i, entry in enumerate(data):
+        fields, error = _validate_save(entry)
+        if error:
+            return ojsonify({"error": f"Game {i}: {error}"}), 400
+        checked.append((entry.get("id"), fields))
+
+    ids = [game_id for game_id, _ in checked if game_id]
+    existing = {}
+    if ids:
+        existing = {g.id: g for g in Game.query.filter(
+            Game.session_id == session["session_id"], Game.id.in_(ids))}
+
+    games = []
+    for game_id, fields in checked:
+        game = existing.get(game_id)
+        if game:
+            for key, value in fields.items():
+                setattr(game, key, value)
+        else:
+            game = Game(session_id=session["session_id"], **fields)
+            db.session.add(game)
+        games.append(game)
+
+    db.session.flush()
+    saved_ids = [game.id for game in games]
+    db.session.commit()
+
+    app.logger.info("Bulk-saved %d games", len(games))
+    return ojsonify({"ok": True, "saved": len(games), "ids": saved_ids}), 201
+
+
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+
+LIST_PAGE_MAX = 200
 
 
 @app.route("/api/games", methods=["GET"])
 def list_games():
-    games = Game.query.filter_by(session_id=session["session_id"]).order_by(Game.id).all()
-    return jsonify([g.to_dict() for g in games])
+    """List this session's games, newest first.
+
+    With ?limit=N one keyset page is returned; send its X-Next-Cursor header back
+    as ?cursor= for the next page. Without a limit the whole list is streamed."""
+    sid = session["session_id"]
+    query = Game.query.filter_by(session_id=sid)
+
+    cursor = request.args.get("cursor", type=int)
+    if cursor:
+        # Seek past the cursor row using the (session_id, created_at) index. Its
+        # created_at is compared in SQL so the stored value is matched exactly.
+        cursor_created = (
+            db.select(Game.created_at)
+            .where(Game.id == cursor, Game.session_id == sid)
+            .scalar_subquery()
+        )
+        query = query.filter(db.or_(
+            Game.created_at < cursor_created,
+            db.and_(Game.created_at == cursor_created, Game.id < cursor),
+        ))
+    query = query.order_by(Game.created_at.desc(), Game.id.desc())
+
+    limit = request.args.get("limit", type=int)
+    if limit is not None:
+        limit = max(1, min(limit, LIST_PAGE_MAX))
+        games = query.limit(limit).all()
+        resp = ojsonify([g.to_dict() for g in games])
+        if len(games) == limit:
+            resp.headers["X-Next-Cursor"] = str(games[-1].id)
+        return resp
+
+    def generate():
+        yield b"["
+        for i, game in enumerate(query.yield_per(200)):
+            yield (b"," if i else b"") + orjson.dumps(game.to_dict())
+        yield b"]"
+
+    return Response(stream_with_context(generate()), mimetype="application/json")
 
 
 @app.route("/api/games/<int:game_id>", methods=["DELETE"])
 def delete_game(game_id):
     game = Game.query.filter_by(id=game_id, session_id=session["session_id"]).first()
     if not game:
-        return jsonify({"error": "Game not found"}), 404
+        return ojsonify({"error": "Game not found"}), 404
     db.session.delete(game)
     db.session.commit()
-    return jsonify({"ok": True})
+    return ojsonify({"ok": True})
 
 
 @app.route("/api/games/<int:game_id>/export", methods=["GET"])
 def export_game(game_id):
     game = Game.query.filter_by(id=game_id, session_id=session["session_id"]).first()
     if not game:
-        return jsonify({"error": "Game not found"}), 404
+        return ojsonify({"error": "Game not found"}), 404
 
     data = game.to_dict()
     del data["id"]
 
+    body = memoryview(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+
+    def chunks():
+        for start in range(0, len(body), EXPORT_CHUNK_SIZE):
+            yield bytes(body[start:start + EXPORT_CHUNK_SIZE])
+
     filename = (game.name or "game") + ".json"
     return Response(
-        json.dumps(data, indent=2),
+        chunks(),
         mimetype="application/json",
         headers={"Content-Disposition": f"attachment; filename=\"{filename}\""},
     )
 
 
-@app.route("/api/games/import", methods=["POST"])
-def import_game():
-    if "file" not in request.files:
-        return jsonify({"error": "No file provided"}), 400
-
-    f = request.files["file"]
-    try:
-        data = json.loads(f.read())
-    except (json.JSONDecodeError, UnicodeDecodeError):
-        return jsonify({"error": "Invalid JSON file"}), 400
+def _game_from_import(data):
+    """Validate one exported game dict. Returns (Game, None) or (None, error_message)."""
+    if not isinstance(data, dict):
+        return None, "Invalid game entry"
 
     # Validate required fields
     name = data.get("name", "").strip()
     if not name:
-        return jsonify({"error": "Missing game name"}), 400
+        return None, "Missing game name"
 
     history = data.get("history")
     if not isinstance(history, list) or len(history) == 0:
-        return jsonify({"error": "Missing or empty history"}), 400
+        return None, "Missing or empty history"
 
-    game = Game(
+    return Game(
         session_id=session["session_id"],
         name=name,
         date=data.get("date", ""),
         moves=data.get("moves", ""),
-        history=json.dumps(history),
+        history=history_json(history),
         move_count=data.get("moveCount", len(history)),
-    )
+    ), None
+
+
+@app.route("/api/games/import", methods=["POST"])
+def import_game():
+    if "file" not in request.files:
+        return ojsonify({"error": "No file provided"}), 400
+
+    f = request.files["file"]
+    try:
+        data = json.loads(f.read())
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return ojsonify({"error": "Invalid JSON file"}), 400
+
+    game, error = _game_from_import(data)
+    if error:
+        return ojsonify({"error": error}), 400
+
     db.session.add(game)
     db.session.commit()
 
-    return jsonify(game.to_dict()), 201
+    return ojsonify(game.to_dict()), 201
+
+
+@app.route("/api/games/bulk-import", methods=["POST"])
+def bulk_import():
+    """Import a JSON array of exported games in a single transaction."""
+    data = request.get_json()
+    if not isinstance(data, list) or len(data) == 0:
+        return ojsonify({"error": "Expected a non-empty array of games"}), 400
+
+    games = []
+    for i, entry in enumerate(data):
+        game, error = _game_from_import(entry)
+        if error:
+            return ojsonify({"error": f"Game {i}: {error}"}), 400
+        games.append(game)
+
+    db.session.bulk_save_objects(games)
+    db.session.commit()
+
+    app.logger.info("Bulk-imported %d games", len(games))
+    return ojsonify({"ok": True, "imported": len(games)}), 201
+
+
+# --- Background tasks ---
+
+@celery.task(name="chessguardian.run_stockfish")
+def run_stockfish(fen):
+    """Queued counterpart of /api/move."""
+    board = chess.Board(fen)
+    uci, san = _stockfish_move(board)
+    if not uci:
+        return {"error": "Stockfish could not find a move"}
+    payload = {"move": uci, "san": san}
+    cache_put(_move_cache, (move_cache_fen(fen), STOCKFISH_SKILL, STOCKFISH_DEPTH), payload)
+    return payload
+
+
+@celery.task(name="chessguardian.run_analysis")
+def run_analysis(fen, move_history="", model=OPENAI_MODEL):
+    """Queued counterpart of /api/analyze."""
+    board = chess.Board(fen)
+    payload = _quick_analysis(board, fen, move_history, model)
+    if payload:
+        return payload
+    payload = _complete_analysis(board, fen, move_history, model)
+    analysis_cache_put(analysis_cache_key(fen, move_history, model), payload)
+    return payload
+
+
+@app.route("/api/tasks/<task_id>", methods=["GET"])
+def task_status(task_id):
+    """Poll a task queued by /api/move or /api/analyze with {"async": true}."""
+    result = celery.AsyncResult(task_id)
+    if not result.ready():
+        return ojsonify({"task_id": task_id, "status": result.state.lower()})
+    if result.failed():
+        return ojsonify({"task_id": task_id, "status": "failed", "error": str(result.result)}), 500
+    return ojsonify({"task_id": task_id, "status": "done", "result": result.result})
+
+
+# --- Post-game annotation (OpenAI Batch API) ---
+
+BATCH_TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+def _annotation_batch_jsonl(history):
+    """One chat-completion request per ply, analyzing the position after it.
+    Raises ValueError if the saved history is not a legal game."""
+    board = chess.Board()
+    lines = []
+    for ply, san in enumerate(history):
+        board.push_san(san)
+        if board.is_game_over():
+            break
+        user_message = _build_user_message(board, board.fen(), " ".join(history[:ply + 1]))
+        lines.append(json.dumps({
+            "custom_id": f"ply-{ply}",
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": _completion_request(user_message),
+        }))
+    return "\n".join(lines).encode("utf-8")
+
+
+def _collect_annotations(output_file_id):
+    """Download a finished batch's output and return analyses ordered by ply."""
+    content = client.files.content(output_file_id).text
+    by_ply = {}
+    for line in content.splitlines():
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        ply = int(record["custom_id"].split("-", 1)[1])
+        try:
+            raw = record["response"]["body"]["choices"][0]["message"]["content"]
+            by_ply[ply] = _parse_analysis(raw)
+        except (KeyError, IndexError, TypeError, ValueError):
+            by_ply[ply] = None
+    return [{"ply": ply, **(by_ply[ply] or {"error": "No analysis"})} for ply in sorted(by_ply)]
+
+
+@app.route("/api/games/<int:game_id>/annotate", methods=["POST"])
+def annotate_game(game_id):
+    """Submit every ply of a saved game for analysis as one OpenAI batch."""
+    game = Game.query.filter_by(id=game_id, session_id=session["session_id"]).first()
+    if not game:
+        return ojsonify({"error": "Game not found"}), 404
+    if game.batch_id and game.batch_status not in BATCH_TERMINAL_STATUSES:
+        return ojsonify({"error": "Annotation already in progress", "status": game.batch_status}), 409
+
+    try:
+        jsonl = _annotation_batch_jsonl(game.history_list)
+    except ValueError:
+        return ojsonify({"error": "Saved history is not a legal game"}), 400
+    if not jsonl:
+        return ojsonify({"error": "No positions to annotate"}), 400
+
+    try:
+        batch_file = client.files.create(file=("annotate.jsonl", jsonl), purpose="batch")
+        batch = client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+            metadata={"game_id": str(game.id)},
+        )
+    except Exception as e:
+        app.logger.error("Batch submit failed for game %s: %s", game.id, str(e), exc_info=True)
+        return ojsonify({"error": f"Annotation request failed: {str(e)}"}), 500
+
+    game.batch_id = batch.id
+    game.batch_status = batch.status
+    game.annotations = None
+    db.session.commit()
+
+    app.logger.info("Game %s: annotation batch %s submitted", game.id, batch.id)
+    return ojsonify({"batchId": batch.id, "status": batch.status}), 202
+
+
+@app.route("/api/games/<int:game_id>/annotate/status", methods=["GET"])
+def annotate_status(game_id):
+    """Refresh the batch status from OpenAI and return annotations once complete."""
+    game = Game.query.filter_by(id=game_id, session_id=session["session_id"]).first()
+    if not game:
+        return ojsonify({"error": "Game not found"}), 404
+    if not game.batch_id:
+        return ojsonify({"error": "Game has not been submitted for annotation"}), 404
+
+    if game.batch_status not in BATCH_TERMINAL_STATUSES or (game.batch_status == "completed" and not game.annotations):
+        try:
+            batch = client.batches.retrieve(game.batch_id)
+            game.batch_status = batch.status
+            if batch.status == "completed" and batch.output_file_id:
+                game.annotations = json.dumps(_collect_annotations(batch.output_file_id))
+            db.session.commit()
+        except Exception as e:
+            app.logger.error("Batch poll failed for game %s: %s", game.id, str(e), exc_info=True)
+            return ojsonify({"error": f"Could not fetch annotation status: {str(e)}"}), 502
+
+    return ojsonify({
+        "batchId": game.batch_id,
+        "status": game.batch_status,
+        "annotations": json.loads(game.annotations) if game.annotations else None,
+    })
 
 
 # --- Live Game API ---
 
+# Wakes /events streams and long-polls in this process as soon as a game changes.
+# Waiters also re-read the row every LIVE_RECHECK_SECONDS, which picks up moves
+# handled by other worker processes.
+_live_changed = threading.Condition()
+LIVE_RECHECK_SECONDS = 1.0
+LIVE_POLL_SECONDS = 25
+LIVE_STREAM_SECONDS = LIVE_POLL_SECONDS
+
+# Under gunicorn's default gthread workers every waiting stream or long-poll holds a
+# worker thread, so only LIVE_MAX_WAITERS may wait at once per process; the rest get
+# a 503 and retry after LIVE_RETRY_SECONDS. Raise it when running gevent/eventlet workers.
+LIVE_MAX_WAITERS = int(os.getenv("LIVE_MAX_WAITERS", "4"))
+LIVE_RETRY_SECONDS = 2
+_live_waiters = threading.BoundedSemaphore(LIVE_MAX_WAITERS)
+
+
+def _live_busy(body, mimetype="application/json"):
+    """503 telling the client to come back in LIVE_RETRY_SECONDS."""
+    return Response(body, status=503, mimetype=mimetype,
+                    headers={"Retry-After": str(LIVE_RETRY_SECONDS)})
+
+
+def notify_live_change():
+    with _live_changed:
+        _live_changed.notify_all()
+
+
+def _wait_live_change(timeout=LIVE_RECHECK_SECONDS):
+    with _live_changed:
+        _live_changed.wait(timeout)
+
+
+def _fresh_live_game(game_id):
+    """Re-read a live game, ending the previous read transaction so SQLite's WAL
+    snapshot does not hide newer commits."""
+    db.session.rollback()
+    return db.session.get(LiveGame, game_id, populate_existing=True)
+
+
 def _check_game_over(board):
     """Check board state and return (status, result) or (None, None) if active."""
     if board.is_checkmate():
@@ -404,9 +1325,12 @@ def _check_game_over(board):
 
 def _stockfish_move(board):
     """Get Stockfish's move and return (uci, san)."""
-    sf = get_stockfish()
-    sf.set_fen_position(board.fen())
-    uci = sf.get_best_move()
+    move = instant_move(board)
+    if move:
+        return move.uci(), board.san(move)
+    with engine_pool.acquire() as sf:
+        sf.set_fen_position(board.fen())
+        uci = sf.get_best_move()
     if not uci:
         return None, None
     move = chess.Move.from_uci(uci)
@@ -416,30 +1340,13 @@ def _stockfish_move(board):
 
 def _analyze_position(board, move_history):
     """Call OpenAI analysis and return dict with bestMove, explanation, evaluation, winChance."""
-    side_to_move = "White" if board.turn == chess.WHITE else "Black"
-    legal_moves = " ".join(board.san(m) for m in board.legal_moves)
-    user_message = f"Position (FEN): {board.fen()}\nIt is {side_to_move}'s turn to move. Suggest the best move for {side_to_move}."
-    user_message += f"\nLegal moves: {legal_moves}"
-    user_message += "\nIMPORTANT: You MUST recommend one of the legal moves listed above."
-    if move_history:
-        user_message += f"\nMove history: {' '.join(move_history)}"
     try:
-        response = client.chat.completions.create(
-            model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": user_message}
-            ],
-            max_tokens=500,
-            response_format={"type": "json_object"},
-        )
-        raw = response.choices[0].message.content.strip()
-        result = json.loads(raw)
+        result = _complete_analysis(board, board.fen(), " ".join(move_history), pick_model(board))
         return {
-            "bestMove": result.get("bestMove", ""),
-            "explanation": result.get("explanation", ""),
-            "evaluation": result.get("evaluation", ""),
-            "winChance": max(0, min(100, int(result.get("winChance", 50)))),
+            "bestMove": result["bestMove"],
+            "explanation": result["explanation"],
+            "evaluation": result["evaluation"],
+            "winChance": result["winChance"],
         }
     except Exception as e:
         app.logger.error("Live game analysis error: %s", str(e), exc_info=True)
@@ -456,62 +1363,62 @@ def live_start():
         white_player = data.get("white_player", "").strip()
         black_player = data.get("black_player", "").strip()
         if not white_player or not black_player:
-            return jsonify({"error": "white_player and black_player are required for PvP mode"}), 400
+            return ojsonify({"error": "white_player and black_player are required for PvP mode"}), 400
         if white_player == black_player:
-            return jsonify({"error": "white_player and black_player must be different"}), 400
+            return ojsonify({"error": "white_player and black_player must be different"}), 400
 
         board = chess.Board()
         game = LiveGame(
-            id=game_id, fen=board.fen(), history=json.dumps([]),
+            id=game_id, fen=board.fen(), history=history_json([]),
             mode='pvp', white_player=white_player, black_player=black_player,
         )
         db.session.add(game)
         db.session.commit()
 
         app.logger.info("PvP game %s started: %s (W) vs %s (B)", game_id, white_player, black_player)
-        return jsonify({"id": game_id, "fen": board.fen(), "history": [], "turn": "white", "mode": "pvp"}), 201
+        return ojsonify({"id": game_id, "fen": board.fen(), "history": [], "turn": "white", "mode": "pvp"}), 201
 
     # AI mode (default)
     board = chess.Board()
     uci, san = _stockfish_move(board)
     if not uci:
-        return jsonify({"error": "Stockfish failed"}), 500
+        return ojsonify({"error": "Stockfish failed"}), 500
 
     board.push(chess.Move.from_uci(uci))
     history = [san]
 
-    game = LiveGame(id=game_id, fen=board.fen(), history=json.dumps(history))
+    game = LiveGame(id=game_id, fen=board.fen(), history=history_json(history))
     db.session.add(game)
     db.session.commit()
 
     app.logger.info("Live game %s started. Stockfish opened with %s", game_id, san)
-    return jsonify({"id": game_id, "fen": board.fen(), "lastMove": san, "history": history}), 201
+    return ojsonify({"id": game_id, "fen": board.fen(), "lastMove": san, "history": history}), 201
 
 
 @app.route("/api/live/<game_id>/move", methods=["POST"])
 def live_move(game_id):
     game = LiveGame.query.get(game_id)
     if not game:
-        return jsonify({"error": "Game not found"}), 404
+        return ojsonify({"error": "Game not found"}), 404
     if game.status != "active":
-        return jsonify({"error": "Game is over", **game.to_dict()}), 400
+        return ojsonify({"error": "Game is over", **game.to_dict()}), 400
 
     data = request.get_json()
     if not data or not data.get("move"):
-        return jsonify({"error": "move is required"}), 400
+        return ojsonify({"error": "move is required"}), 400
 
     board = chess.Board(game.fen)
-    history = json.loads(game.history)
+    history = list(game.history_list)  # Copied: appended to below
 
     # PvP turn enforcement
     if game.mode == 'pvp':
         player = data.get("player", "").strip()
         if not player:
-            return jsonify({"error": "player is required for PvP games"}), 400
+            return ojsonify({"error": "player is required for PvP games"}), 400
         expected_turn = "white" if len(history) % 2 == 0 else "black"
         expected_player = game.white_player if expected_turn == "white" else game.black_player
         if player != expected_player:
-            return jsonify({"error": f"It is {expected_turn}'s turn", "turn": expected_turn}), 403
+            return ojsonify({"error": f"It is {expected_turn}'s turn", "turn": expected_turn}), 403
 
     move_str = data["move"].strip()
 
@@ -529,7 +1436,7 @@ def live_move(game_id):
 
     if not human_move or human_move not in board.legal_moves:
         legal = [board.san(m) for m in board.legal_moves]
-        return jsonify({"error": f"Illegal move: {move_str}", "legalMoves": legal}), 400
+        return ojsonify({"error": f"Illegal move: {move_str}", "legalMoves": legal}), 400
 
     human_san = board.san(human_move)
     board.push(human_move)
@@ -539,10 +1446,11 @@ def live_move(game_id):
     status, result = _check_game_over(board)
     if status:
         game.fen = board.fen()
-        game.history = json.dumps(history)
+        game.history = history_json(history)
         game.status = status
         game.result = result
         db.session.commit()
+        notify_live_change()
         resp = {
             "fen": board.fen(), "humanMove": human_san, "stockfishMove": None,
             "analysis": {"bestMove": "", "explanation": f"Game over: {status}", "evaluation": result, "winChance": 50},
@@ -550,16 +1458,17 @@ def live_move(game_id):
         }
         if game.mode == 'pvp':
             resp["turn"] = None
-        return jsonify(resp)
+        return ojsonify(resp)
 
     # PvP: no Stockfish reply, no analysis
     if game.mode == 'pvp':
         game.fen = board.fen()
-        game.history = json.dumps(history)
+        game.history = history_json(history)
         db.session.commit()
+        notify_live_change()
         turn = "white" if len(history) % 2 == 0 else "black"
         app.logger.info("PvP game %s: %s played %s | turn=%s", game_id, data.get("player"), human_san, turn)
-        return jsonify({
+        return ojsonify({
             "fen": board.fen(), "humanMove": human_san,
             "history": history, "gameOver": False, "status": "active", "turn": turn,
         })
@@ -567,7 +1476,7 @@ def live_move(game_id):
     # AI mode: Stockfish replies as White
     uci, sf_san = _stockfish_move(board)
     if not uci:
-        return jsonify({"error": "Stockfish failed"}), 500
+        return ojsonify({"error": "Stockfish failed"}), 500
 
     board.push(chess.Move.from_uci(uci))
     history.append(sf_san)
@@ -580,8 +1489,9 @@ def live_move(game_id):
         game.result = result
 
     game.fen = board.fen()
-    game.history = json.dumps(history)
+    game.history = history_json(history)
     db.session.commit()
+    notify_live_change()
 
     # Analyze position (for Black's next move)
     analysis = {"bestMove": "", "explanation": "", "evaluation": "", "winChance": 50}
@@ -590,7 +1500,7 @@ def live_move(game_id):
 
     app.logger.info("Live game %s: ...%s %s | game_over=%s", game_id, human_san, sf_san, game_over)
 
-    return jsonify({
+    return ojsonify({
         "fen": board.fen(), "humanMove": human_san, "stockfishMove": sf_san,
         "analysis": analysis, "history": history,
         "gameOver": game_over, "status": game.status,
@@ -601,15 +1511,15 @@ def live_move(game_id):
 def resign_game(game_id):
     game = LiveGame.query.get(game_id)
     if not game:
-        return jsonify({"error": "Game not found"}), 404
+        return ojsonify({"error": "Game not found"}), 404
     if game.status != 'active':
-        return jsonify({"error": "Game is already over"}), 400
+        return ojsonify({"error": "Game is already over"}), 400
 
     if game.mode == 'pvp':
         data = request.get_json() or {}
         player = data.get("player", "").strip()
         if not player:
-            return jsonify({"error": "player is required for PvP games"}), 400
+            return ojsonify({"error": "player is required for PvP games"}), 400
         if player == game.white_player:
             game.result = '0-1'
             msg = "White resigned. Black wins!"
@@ -617,19 +1527,21 @@ def resign_game(game_id):
             game.result = '1-0'
             msg = "Black resigned. White wins!"
         else:
-            return jsonify({"error": "Player not in this game"}), 403
+            return ojsonify({"error": "Player not in this game"}), 403
         game.status = 'resigned'
         db.session.commit()
+        notify_live_change()
         app.logger.info("PvP game %s: %s resigned. Result: %s", game_id, player, game.result)
-        return jsonify({"id": game.id, "status": "resigned", "result": game.result, "gameOver": True, "message": msg})
+        return ojsonify({"id": game.id, "status": "resigned", "result": game.result, "gameOver": True, "message": msg})
 
     # AI mode: Black (human) resigns, White wins
     game.status = 'resigned'
     game.result = '1-0'
     db.session.commit()
+    notify_live_change()
 
     app.logger.info("Game %s: Black resigned. Result: 1-0", game_id)
-    return jsonify({
+    return ojsonify({
         "id": game.id,
         "status": "resigned",
         "result": "1-0",
@@ -642,29 +1554,87 @@ def resign_game(game_id):
 def live_auth(game_id):
     game = LiveGame.query.get(game_id)
     if not game:
-        return jsonify({"error": "Game not found"}), 404
+        return ojsonify({"error": "Game not found"}), 404
 
     player = request.args.get("player", "").strip()
     if not player:
-        return jsonify({"error": "player query param is required"}), 400
+        return ojsonify({"error": "player query param is required"}), 400
 
-    history = json.loads(game.history)
+    history = game.history_list
     turn = "white" if len(history) % 2 == 0 else "black"
 
     if player == game.white_player:
-        return jsonify({"authorized": True, "color": "white", "turn": turn == "white"})
+        return ojsonify({"authorized": True, "color": "white", "turn": turn == "white"})
     elif player == game.black_player:
-        return jsonify({"authorized": True, "color": "black", "turn": turn == "black"})
+        return ojsonify({"authorized": True, "color": "black", "turn": turn == "black"})
     else:
-        return jsonify({"authorized": False})
+        return ojsonify({"authorized": False})
 
 
 @app.route("/api/live/<game_id>", methods=["GET"])
 def live_state(game_id):
+    """Current state. With ?since=<ply> this long-polls: it waits up to
+    LIVE_POLL_SECONDS for the game to move past that ply or finish."""
     game = LiveGame.query.get(game_id)
     if not game:
-        return jsonify({"error": "Game not found"}), 404
-    return jsonify(game.to_dict())
+        return ojsonify({"error": "Game not found"}), 404
+
+    since = request.args.get("since", type=int)
+    if since is not None and game.status == "active" and len(game.history_list) == since:
+        if not _live_waiters.acquire(blocking=False):
+            return _live_busy(orjson.dumps({"error": "Too many live connections, retry shortly"}))
+        try:
+            deadline = time.monotonic() + LIVE_POLL_SECONDS
+            while game.status == "active" and len(game.history_list) == since and time.monotonic() < deadline:
+                _wait_live_change()
+                game = _fresh_live_game(game_id)
+        finally:
+            _live_waiters.release()
+    return ojsonify(game.to_dict())
+
+
+@app.route("/api/live/<game_id>/events", methods=["GET"])
+def live_events(game_id):
+    """Server-sent events: one ``data:`` frame with the state now and one after every
+    change. The stream ends when the game is over or after LIVE_STREAM_SECONDS;
+    clients reconnect. When LIVE_MAX_WAITERS are already waiting it answers 503."""
+    if not LiveGame.query.get(game_id):
+        return ojsonify({"error": "Game not found"}), 404
+
+    retry = f"retry: {LIVE_RETRY_SECONDS * 1000}\n\n"
+    if not _live_waiters.acquire(blocking=False):
+        return _live_busy(retry, mimetype="text/event-stream")
+
+    def events():
+        yield retry
+        last = None
+        last_sent = time.monotonic()
+        deadline = last_sent + LIVE_STREAM_SECONDS
+        while time.monotonic() < deadline:
+            game = _fresh_live_game(game_id)
+            if not game:
+                return
+            version = (game.fen, game.status)
+            if version != last:
+                last = version
+                last_sent = time.monotonic()
+                state = game.to_dict()
+                yield _sse(state)
+                if state["gameOver"]:
+                    return
+            elif time.monotonic() - last_sent > 15:
+                last_sent = time.monotonic()
+                yield ": keep-alive\n\n"
+            _wait_live_change()
+
+    response = Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    # Runs when the server closes the response, even if the stream never started
+    response.call_on_close(_live_waiters.release)
+    return response
 
 
 @app.route("/api/live/<game_id>/qr")
@@ -675,7 +1645,7 @@ def live_qr(game_id):
 
     game = LiveGame.query.get(game_id)
     if not game:
-        return jsonify({"error": "Game not found"}), 404
+        return ojsonify({"error": "Game not found"}), 404
 
     url = request.host_url.rstrip('/') + f'/live/{game_id}'
     qr = qrcode.QRCode(version=1, box_size=10, border=2)
@@ -5,6 +5,7 @@ Plays as Black using a custom minimax engine against the server's Stockfish (Whi
 Usage:
   python3 autoplay_minimax.py <game_id> [--depth 4] [--delay 5] [--url URL]
   python3 autoplay_minimax.py new [--depth 4] [--delay 5] [--url URL]  # starts a new game
+  python3 autoplay_minimax.py new --depth 8 --time 10  # deepen until 10s per move are spent
 
 The minimax engine evaluates positions using:
   - Material count (piece values)
@@ -12,21 +13,43 @@ The minimax engine evaluates positions using:
   - Mobility (number of legal moves)
   - King safety (castling rights, pawn shield)
   - Center control
+
+With Numba installed (pip install numba), the material/PST/mobility/castling
+terms run as compiled bitboard code from bitboard_eval.py. Building
+minimax_c.pyx (pip install cython && cythonize -i -3 minimax_c.pyx) swaps in
+a compiled alpha-beta search.
 """
 
 import argparse
+import json
 import math
+import os
 import sys
 import time
+from concurrent.futures import ProcessPoolExecutor
 from typing import Optional, Tuple
 
 import chess
+import chess.polyglot
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import bitboard_eval
 
 DEFAULT_URL = "https://chessguardian-production.up.railway.app"
 DEFAULT_DEPTH = 4  # Minimax is much slower than Stockfish, 4 is reasonable
 DEFAULT_DELAY = 5
 
+# One keep-alive connection pool for every API call; idempotent requests (GET)
+# are retried with backoff, POSTed moves never are. 503s from the server's live
+# connection cap are left to watch_states/get_state, which wait out Retry-After.
+SESSION = requests.Session()
+_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4,
+                       max_retries=Retry(total=3, backoff_factor=0.5, respect_retry_after_header=False))
+SESSION.mount("http://", _adapter)
+SESSION.mount("https://", _adapter)
+
 # ─── Piece Values (centipawns) ───
 PIECE_VALUES = {
     chess.PAWN: 100,
@@ -116,18 +139,124 @@ PST = {
 }
 
 
+# ─── Transposition Table ───
+# Zobrist hash -> (depth, flag, value, best_move); value is from White's perspective
+EXACT, LOWER, UPPER = 0, 1, 2
+TT_SIZE = 1_000_000
+TT = {}
+
+
+def tt_store(key: int, depth: int, flag: int, value: int, move: Optional[chess.Move]):
+    """Store a search result, evicting the oldest entry (FIFO) once the table is full."""
+    if key not in TT and len(TT) >= TT_SIZE:
+        del TT[next(iter(TT))]
+    TT[key] = (depth, flag, value, move)
+
+
+# Flat lookups per side; Black's tables are mirrored vertically once at import
+PST_WHITE = {pt: tuple(table) for pt, table in PST.items()}
+PST_BLACK = {pt: tuple(table[(7 - (sq // 8)) * 8 + (sq % 8)] for sq in range(64)) for pt, table in PST.items()}
+
+
 def pst_value(piece_type: int, square: int, is_white: bool) -> int:
-    """Get piece-square table value. Flip table for black pieces."""
-    table = PST.get(piece_type)
-    if not table:
-        return 0
-    if is_white:
-        return table[square]
-    else:
-        # Mirror vertically for black
-        row = 7 - (square // 8)
-        col = square % 8
-        return table[row * 8 + col]
+    """Get piece-square table value. Black uses the mirrored table."""
+    return (PST_WHITE if is_white else PST_BLACK)[piece_type][square]
+
+
+# Signed material + PST per [color][piece_type][square] (White positive), for IncBoard
+PIECE_SQUARE_SCORE = {
+    color: {
+        pt: tuple((PIECE_VALUES[pt] + pst_value(pt, sq, color)) * (1 if color == chess.WHITE else -1) for sq in range(64))
+        for pt in PIECE_VALUES
+    }
+    for color in chess.COLORS
+}
+
+
+def _generate_material_pst():
+    """Build material_pst() with every material + PST number inlined as a tuple constant.
+
+    The generated code walks each piece bitboard per colour and indexes a literal
+    tuple, so there are no dict lookups or Piece objects per piece. Looks like:
+
+        def material_pst(board):
+            white = board.occupied_co[True]
+            black = board.occupied_co[False]
+            score = 0
+            for sq in scan_forward(board.pawns & white):
+                score += (0, 0, ...)[sq]
+            ...
+    """
+    lines = [
+        "def material_pst(board):",
+        "    white = board.occupied_co[True]",
+        "    black = board.occupied_co[False]",
+        "    score = 0",
+    ]
+    for piece_type in chess.PIECE_TYPES:
+        attr = chess.piece_name(piece_type) + "s"
+        for color, occupancy in ((chess.WHITE, "white"), (chess.BLACK, "black")):
+            lines.append(f"    for sq in scan_forward(board.{attr} & {occupancy}):")
+            lines.append(f"        score += {PIECE_SQUARE_SCORE[color][piece_type]!r}[sq]")
+    lines.append("    return score")
+    namespace = {"scan_forward": chess.scan_forward}
+    exec("\n".join(lines), namespace)
+    material_pst = namespace["material_pst"]
+    material_pst.__doc__ = "Full material + PST score from White's perspective (generated)."
+    return material_pst
+
+
+material_pst = _generate_material_pst()
+
+
+class IncBoard(chess.Board):
+    """Board that keeps ``mat_pst`` (material + PST, White POV) up to date across push/pop.
+
+    push works out the score change from the moving, captured and promoted
+    pieces and remembers it for pop, instead of evaluate() walking the piece
+    map at every leaf."""
+
+    def __init__(self, fen: Optional[str] = chess.STARTING_FEN, **kwargs):
+        super().__init__(fen, **kwargs)
+        self.mat_pst = material_pst(self)
+        self._deltas = []
+
+    def push(self, move: chess.Move) -> None:
+        delta = 0
+        if move:
+            us = PIECE_SQUARE_SCORE[self.turn]
+            them = PIECE_SQUARE_SCORE[not self.turn]
+            frm, to = move.from_square, move.to_square
+            piece = self.piece_type_at(frm)
+            captured = self.piece_type_at(to)
+            delta = us[move.promotion or piece][to] - us[piece][frm]
+            if captured:
+                delta -= them[captured][to]
+            elif piece == chess.PAWN and (frm - to) % 8:
+                # En passant: the captured pawn sits beside the destination
+                delta -= them[chess.PAWN][to + (-8 if self.turn == chess.WHITE else 8)]
+            if piece == chess.KING and abs(frm - to) == 2:
+                # Castling: the rook jumps to the other side of the king
+                rook_from, rook_to = (frm + 3, frm + 1) if to > frm else (frm - 4, frm - 1)
+                delta += us[chess.ROOK][rook_to] - us[chess.ROOK][rook_from]
+        super().push(move)
+        self._deltas.append(delta)
+        self.mat_pst += delta
+
+    def pop(self) -> chess.Move:
+        move = super().pop()
+        self.mat_pst -= self._deltas.pop()
+        return move
+
+    def copy(self, *, stack=True):
+        board = super().copy(stack=stack)
+        board.mat_pst = self.mat_pst
+        board._deltas = self._deltas[len(self._deltas) - len(board.move_stack):]
+        return board
+
+
+# Numba-compiled material/PST/mobility/castling terms, when Numba is installed
+evaluate_bb = bitboard_eval.make_evaluate_bb(PIECE_SQUARE_SCORE) if bitboard_eval.AVAILABLE else None
 
 
 def evaluate(board: chess.Board) -> int:
@@ -138,36 +267,33 @@ def evaluate(board: chess.Board) -> int:
         return -30000 if board.turn == chess.WHITE else 30000
     if board.is_stalemate() or board.is_insufficient_material():
         return 0
-    if board.can_claim_draw():
+    if board.halfmove_clock >= 100:
+        # 50-move rule only: a repetition claim walks the move stack and is too costly per leaf
         return 0
 
-    score = 0
+    if evaluate_bb:
+        # Material, PST, (pseudo-legal) mobility and castling rights in one native call
+        score = evaluate_bb(*bitboard_eval.board_args(board))
+    else:
+        # Material + piece-square tables (kept incrementally by IncBoard)
+        score = board.mat_pst if isinstance(board, IncBoard) else material_pst(board)
 
-    # Material + piece-square tables
-    for square, piece in board.piece_map().items():
-        value = PIECE_VALUES.get(piece.piece_type, 0)
-        pst = pst_value(piece.piece_type, square, piece.color == chess.WHITE)
-        if piece.color == chess.WHITE:
-            score += value + pst
+        # Mobility bonus (number of legal moves)
+        mobility = board.legal_moves.count()
+        if board.turn == chess.WHITE:
+            score += mobility * 2
         else:
-            score -= value + pst
-
-    # Mobility bonus (number of legal moves)
-    mobility = board.legal_moves.count()
-    if board.turn == chess.WHITE:
-        score += mobility * 2
-    else:
-        score -= mobility * 2
-
-    # Bonus for castling rights
-    if board.has_kingside_castling_rights(chess.WHITE):
-        score += 15
-    if board.has_queenside_castling_rights(chess.WHITE):
-        score += 10
-    if board.has_kingside_castling_rights(chess.BLACK):
-        score -= 15
-    if board.has_queenside_castling_rights(chess.BLACK):
-        score -= 10
+            score -= mobility * 2
+
+        # Bonus for castling rights
+        if board.has_kingside_castling_rights(chess.WHITE):
+            score += 15
+        if board.has_queenside_castling_rights(chess.WHITE):
+            score += 10
+        if board.has_kingside_castling_rights(chess.BLACK):
+            score -= 15
+        if board.has_queenside_castling_rights(chess.BLACK):
+            score -= 10
 
     # Check bonus
     if board.is_check():
@@ -176,46 +302,114 @@ def evaluate(board: chess.Board) -> int:
     return score
 
 
-def order_moves(board: chess.Board):
-    """Order moves for better alpha-beta pruning: captures first, then checks."""
+def mvv_lva(board: chess.Board, move: chess.Move) -> int:
+    """Capture/promotion ordering score: most valuable victim, least valuable attacker."""
+    s = 0
+    if board.is_capture(move):
+        victim = board.piece_type_at(move.to_square)
+        attacker = board.piece_type_at(move.from_square)
+        if victim and attacker:
+            s += PIECE_VALUES.get(victim, 0) * 10 - PIECE_VALUES.get(attacker, 0)
+        else:
+            s += 500  # En passant
+    if move.promotion:
+        s += PIECE_VALUES.get(move.promotion, 0)
+    return s
+
+
+def order_moves(board: chess.Board, tt_move: Optional[chess.Move] = None):
+    """Order moves for better alpha-beta pruning: TT move, then captures, then checks."""
     moves = list(board.legal_moves)
 
     def move_score(move):
-        s = 0
-        # MVV-LVA for captures
-        if board.is_capture(move):
-            victim = board.piece_type_at(move.to_square)
-            attacker = board.piece_type_at(move.from_square)
-            if victim and attacker:
-                s += PIECE_VALUES.get(victim, 0) * 10 - PIECE_VALUES.get(attacker, 0)
-            else:
-                s += 500
-        # Promotion
-        if move.promotion:
-            s += PIECE_VALUES.get(move.promotion, 0)
+        s = mvv_lva(board, move)
         # Check
-        board.push(move)
-        if board.is_check():
+        if board.gives_check(move):
             s += 50
-        board.pop()
         return -s  # Negative for descending sort
 
     moves.sort(key=move_score)
+    if tt_move in moves:
+        moves.remove(tt_move)
+        moves.insert(0, tt_move)
     return moves
 
 
+def noisy_moves(board: chess.Board):
+    """Legal captures and promotions, best MVV-LVA first."""
+    moves = list(board.generate_legal_captures())
+    moves += [m for m in board.generate_legal_moves(board.pawns, chess.BB_BACKRANKS) if not board.is_capture(m)]
+    moves.sort(key=lambda m: mvv_lva(board, m), reverse=True)
+    return moves
+
+
+def quiescence(board: chess.Board, alpha: int, beta: int, maximizing: bool) -> int:
+    """Extend the search along captures and promotions until the position is quiet,
+    so the static evaluation is never taken in the middle of an exchange."""
+    stand_pat = evaluate(board)  # Also scores mate/stalemate, where there are no moves to try
+
+    if maximizing:
+        if stand_pat >= beta:
+            return stand_pat
+        alpha = max(alpha, stand_pat)
+        best = stand_pat
+        for move in noisy_moves(board):
+            board.push(move)
+            score = quiescence(board, alpha, beta, False)
+            board.pop()
+            if score > best:
+                best = score
+            alpha = max(alpha, score)
+            if beta <= alpha:
+                break
+        return best
+    else:
+        if stand_pat <= alpha:
+            return stand_pat
+        beta = min(beta, stand_pat)
+        best = stand_pat
+        for move in noisy_moves(board):
+            board.push(move)
+            score = quiescence(board, alpha, beta, True)
+            board.pop()
+            if score < best:
+                best = score
+            beta = min(beta, score)
+            if beta <= alpha:
+                break
+        return best
+
+
 def minimax(board: chess.Board, depth: int, alpha: int, beta: int, maximizing: bool) -> Tuple[int, Optional[chess.Move]]:
     """Minimax with alpha-beta pruning.
     Returns (eval_score, best_move)."""
 
-    if depth == 0 or board.is_game_over():
+    if board.is_game_over():
         return evaluate(board), None
+    if depth == 0:
+        return quiescence(board, alpha, beta, maximizing), None
+
+    alpha_orig, beta_orig = alpha, beta
+    key = chess.polyglot.zobrist_hash(board)
+    tt_move = None
+    entry = TT.get(key)
+    if entry:
+        tt_depth, flag, value, tt_move = entry
+        if tt_depth >= depth:
+            if flag == EXACT:
+                return value, tt_move
+            if flag == LOWER:
+                alpha = max(alpha, value)
+            else:
+                beta = min(beta, value)
+            if alpha >= beta:
+                return value, tt_move
 
     best_move = None
 
     if maximizing:
-        max_eval = -999999
-        for move in order_moves(board):
+        max_eval = alpha  # Fail-hard: scores outside the window are clamped to its bounds
+        for move in order_moves(board, tt_move):
             board.push(move)
             eval_score, _ = minimax(board, depth - 1, alpha, beta, False)
             board.pop()
@@ -225,10 +419,10 @@ def minimax(board: chess.Board, depth: int, alpha: int, beta: int, maximizing: b
             alpha = max(alpha, eval_score)
             if beta <= alpha:
                 break  # Beta cutoff
-        return max_eval, best_move
+        best_eval = max_eval
     else:
-        min_eval = 999999
-        for move in order_moves(board):
+        min_eval = beta
+        for move in order_moves(board, tt_move):
             board.push(move)
             eval_score, _ = minimax(board, depth - 1, alpha, beta, True)
             board.pop()
@@ -238,16 +432,84 @@ def minimax(board: chess.Board, depth: int, alpha: int, beta: int, maximizing: b
             beta = min(beta, eval_score)
             if beta <= alpha:
                 break  # Alpha cutoff
-        return min_eval, best_move
+        best_eval = min_eval
+
+    if best_eval <= alpha_orig:
+        flag = UPPER
+    elif best_eval >= beta_orig:
+        flag = LOWER
+    else:
+        flag = EXACT
+    tt_store(key, depth, flag, best_eval, best_move)
+    return best_eval, best_move
+
+
+# Compiled search from minimax_c.pyx, when it has been built (cythonize -i -3 minimax_c.pyx)
+try:
+    import minimax_c
+except ImportError:
+    pass
+else:
+    minimax_c.bind(evaluate, quiescence, order_moves, TT, tt_store)
+    minimax = minimax_c.minimax
+
 
+# ─── Parallel root search ───
+_executor = None
 
-def find_best_move(fen: str, depth: int) -> Tuple[str, str, str, int]:
-    """Find the best move using minimax. Returns (san, uci, eval_str, eval_cp)."""
-    board = chess.Board(fen)
+
+def get_executor(workers: int) -> ProcessPoolExecutor:
+    """Process pool kept for the whole game, so each worker's TT stays warm between moves."""
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=workers)
+    return _executor
+
+
+def _search_after(fen: str, uci: str, depth: int, maximizing: bool) -> int:
+    """Worker: score the position after one root move with a full-window search."""
+    board = IncBoard(fen)
+    board.push(chess.Move.from_uci(uci))
+    score, _ = minimax(board, depth, -999999, 999999, maximizing)
+    return score
+
+
+def search_root_parallel(board: IncBoard, depth: int, maximizing: bool, workers: int,
+                         first: Optional[chess.Move] = None) -> Tuple[int, Optional[chess.Move]]:
+    """Search each root move in its own process (no root-level pruning) and pick the best."""
+    moves = order_moves(board, first)
+    if not moves:
+        return evaluate(board), None
+    fen = board.fen()
+    ex = get_executor(workers)
+    futures = [(ex.submit(_search_after, fen, move.uci(), depth - 1, not maximizing), move) for move in moves]
+    scored = [(future.result(), move) for future, move in futures]
+    # Stable: on equal scores the earlier (better ordered) move wins
+    pick = max if maximizing else min
+    return pick(scored, key=lambda item: item[0])
+
+
+def find_best_move(fen: str, depth: int, time_limit: Optional[float] = None,
+                   workers: int = 1) -> Tuple[str, str, str, int]:
+    """Find the best move using iterative-deepening minimax. Returns (san, uci, eval_str, eval_cp).
+
+    Each iteration leaves its best moves in the transposition table, which orders
+    the next, deeper iteration. With ``time_limit`` (seconds), no new iteration is
+    started once the budget is spent and the last completed one is used. With
+    ``workers`` > 1, iterations from depth 2 split the root moves across processes."""
+    board = IncBoard(fen)
     maximizing = board.turn == chess.WHITE
 
     start = time.time()
-    eval_cp, best_move = minimax(board, depth, -999999, 999999, maximizing)
+    eval_cp, best_move, reached = 0, None, 0
+    for d in range(1, depth + 1):
+        if workers > 1 and d > 1:
+            eval_cp, best_move = search_root_parallel(board, d, maximizing, workers, best_move)
+        else:
+            eval_cp, best_move = minimax(board, d, -999999, 999999, maximizing)
+        reached = d
+        if time_limit is not None and time.time() - start >= time_limit:
+            break
     elapsed = time.time() - start
 
     if not best_move:
@@ -259,14 +521,14 @@ def find_best_move(fen: str, depth: int) -> Tuple[str, str, str, int]:
     uci = best_move.uci()
     eval_str = f"{eval_cp / 100:+.2f}"
 
-    print(f"         ⏱️  {elapsed:.1f}s | nodes explored")
+    print(f"         ⏱️  {elapsed:.1f}s | depth {reached}")
     return san, uci, eval_str, eval_cp
 
 
 # ─── Game API ───
 
 def start_new_game(base_url):
-    resp = requests.post(f"{base_url}/api/live/start", json={"mode": "ai"})
+    resp = SESSION.post(f"{base_url}/api/live/start", json={"mode": "ai"})
     resp.raise_for_status()
     data = resp.json()
     game_id = data["id"]
@@ -275,14 +537,53 @@ def start_new_game(base_url):
     return game_id
 
 
-def get_state(base_url, game_id):
-    resp = requests.get(f"{base_url}/api/live/{game_id}")
+def get_state(base_url, game_id, since=None):
+    """Fetch the game state. With ``since`` (a ply count) the server long-polls
+    until the game has moved past it."""
+    params = {"since": since} if since is not None else None
+    while True:
+        resp = SESSION.get(f"{base_url}/api/live/{game_id}", params=params, timeout=35)
+        if resp.status_code != 503:
+            break
+        # The server is holding as many waiting connections as it allows
+        time.sleep(float(resp.headers.get("Retry-After", 2)))
     resp.raise_for_status()
     return resp.json()
 
 
+def watch_states(base_url, game_id):
+    """Yield the game state every time it changes.
+
+    Follows the server-sent event stream at /api/live/<id>/events and reconnects
+    when the server ends it. Servers without the stream are long-polled instead."""
+    while True:
+        try:
+            with SESSION.get(f"{base_url}/api/live/{game_id}/events", stream=True, timeout=(10, 60)) as resp:
+                if resp.status_code == 503:
+                    time.sleep(float(resp.headers.get("Retry-After", 2)))
+                    continue
+                if resp.status_code != 200:
+                    break
+                for line in resp.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith("data: "):
+                        continue
+                    state = json.loads(line[len("data: "):])
+                    yield state
+                    if state.get("gameOver"):
+                        return
+        except requests.RequestException:
+            time.sleep(1)
+
+    state = get_state(base_url, game_id)
+    while True:
+        yield state
+        if state.get("error") or state.get("gameOver"):
+            return
+        state = get_state(base_url, game_id, since=len(state.get("history", [])))
+
+
 def make_move(base_url, game_id, move):
-    resp = requests.post(f"{base_url}/api/live/{game_id}/move", json={"move": move})
+    resp = SESSION.post(f"{base_url}/api/live/{game_id}/move", json={"move": move})
     return resp.json()
 
 
@@ -294,6 +595,10 @@ def main():
     parser = argparse.ArgumentParser(description="Minimax Alpha-Beta autoplay for ChessGuardian")
     parser.add_argument("game_id", help="Live game ID or 'new' to start a new game")
     parser.add_argument("--depth", type=int, default=DEFAULT_DEPTH, help=f"Search depth (default: {DEFAULT_DEPTH})")
+    parser.add_argument("--time", type=float, default=None,
+                        help="Per-move time budget in seconds; stops deepening once spent (default: none)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help=f"Processes for the root search (default: 1; this machine has {os.cpu_count()} CPUs)")
     parser.add_argument("--delay", type=float, default=DEFAULT_DELAY)
     parser.add_argument("--url", default=DEFAULT_URL)
     parser.add_argument("--max-moves", type=int, default=200)
@@ -304,7 +609,9 @@ def main():
         game_id = start_new_game(args.url)
 
     print(f"\n🧠 MINIMAX ALPHA-BETA AUTOPLAY — Game {game_id}")
-    print(f"   Engine: Minimax + Alpha-Beta Pruning (depth {args.depth})")
+    budget = f", {args.time:g}s/move" if args.time else ""
+    budget += f", {args.workers} workers" if args.workers > 1 else ""
+    print(f"   Engine: Minimax + Alpha-Beta Pruning (depth {args.depth}{budget})")
     print(f"   Evaluation: Material + PST + Mobility + King Safety")
     print(f"   Delay: {args.delay}s | Max moves: {args.max_moves}")
     print(f"   Live: {args.url}/live/{game_id}")
@@ -312,9 +619,7 @@ def main():
 
     try:
         move_count = 0
-        while move_count < args.max_moves:
-            state = get_state(args.url, game_id)
-
+        for state in watch_states(args.url, game_id):
             if state.get("error"):
                 print(f"❌ {state['error']}")
                 break
@@ -324,14 +629,13 @@ def main():
                 break
 
             if state.get("turn") != "black":
-                time.sleep(1)
                 continue
 
             fen = state["fen"]
             history = state.get("history", [])
             move_num = len(history) // 2 + 1
 
-            san, uci, eval_str, eval_cp = find_best_move(fen, args.depth)
+            san, uci, eval_str, eval_cp = find_best_move(fen, args.depth, args.time, args.workers)
             black_pct = 100 - eval_to_pct(eval_cp)
             print(f"  {move_num}... {san:<8} eval: {eval_str:>8}  Black: {black_pct}%")
 
@@ -356,6 +660,8 @@ def main():
                 break
 
             move_count += 1
+            if move_count >= args.max_moves:
+                break
             time.sleep(args.delay)
 
     except KeyboardInterrupt:
@@ -8,24 +8,41 @@ Usage:
 """
 
 import argparse
+import json
 import math
+import os
 import sys
 import time
 
 import chess
 import chess.engine
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 DEFAULT_URL = "https://chessguardian-production.up.railway.app"
 DEFAULT_DEPTH = 20
 DEFAULT_DELAY = 5
+# A single engine gets the machine; STOCKFISH_THREADS / STOCKFISH_HASH override
+STOCKFISH_THREADS = int(os.getenv("STOCKFISH_THREADS", str(max(1, (os.cpu_count() or 2) - 1))))
+STOCKFISH_HASH = int(os.getenv("STOCKFISH_HASH", "256"))  # MB
+
+# One keep-alive connection pool for every API call; idempotent requests (GET)
+# are retried with backoff, POSTed moves never are. 503s from the server's live
+# connection cap are left to watch_states/get_state, which wait out Retry-After.
+SESSION = requests.Session()
+_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4,
+                       max_retries=Retry(total=3, backoff_factor=0.5, respect_retry_after_header=False))
+SESSION.mount("http://", _adapter)
+SESSION.mount("https://", _adapter)
 
 
 def get_stockfish():
     for path in ["/usr/games/stockfish", "/usr/local/bin/stockfish", "stockfish"]:
         try:
             engine = chess.engine.SimpleEngine.popen_uci(path)
-            print(f"✅ Stockfish loaded: {path}")
+            engine.configure({"Threads": STOCKFISH_THREADS, "Hash": STOCKFISH_HASH})
+            print(f"✅ Stockfish loaded: {path} ({STOCKFISH_THREADS} threads, {STOCKFISH_HASH} MB hash)")
             return engine
         except Exception:
             continue
@@ -34,7 +51,7 @@ def get_stockfish():
 
 
 def start_new_game(base_url):
-    resp = requests.post(f"{base_url}/api/live/start", json={"mode": "ai"})
+    resp = SESSION.post(f"{base_url}/api/live/start", json={"mode": "ai"})
     resp.raise_for_status()
     data = resp.json()
     game_id = data["id"]
@@ -43,25 +60,64 @@ def start_new_game(base_url):
     return game_id
 
 
-def get_state(base_url, game_id):
-    resp = requests.get(f"{base_url}/api/live/{game_id}")
+def get_state(base_url, game_id, since=None):
+    """Fetch the game state. With ``since`` (a ply count) the server long-polls
+    until the game has moved past it."""
+    params = {"since": since} if since is not None else None
+    while True:
+        resp = SESSION.get(f"{base_url}/api/live/{game_id}", params=params, timeout=35)
+        if resp.status_code != 503:
+            break
+        # The server is holding as many waiting connections as it allows
+        time.sleep(float(resp.headers.get("Retry-After", 2)))
     resp.raise_for_status()
     return resp.json()
 
 
+def watch_states(base_url, game_id):
+    """Yield the game state every time it changes.
+
+    Follows the server-sent event stream at /api/live/<id>/events and reconnects
+    when the server ends it. Servers without the stream are long-polled instead."""
+    while True:
+        try:
+            with SESSION.get(f"{base_url}/api/live/{game_id}/events", stream=True, timeout=(10, 60)) as resp:
+                if resp.status_code == 503:
+                    time.sleep(float(resp.headers.get("Retry-After", 2)))
+                    continue
+                if resp.status_code != 200:
+                    break
+                for line in resp.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith("data: "):
+                        continue
+                    state = json.loads(line[len("data: "):])
+                    yield state
+                    if state.get("gameOver"):
+                        return
+        except requests.RequestException:
+            time.sleep(1)
+
+    state = get_state(base_url, game_id)
+    while True:
+        yield state
+        if state.get("error") or state.get("gameOver"):
+            return
+        state = get_state(base_url, game_id, since=len(state.get("history", [])))
+
+
 def make_move(base_url, game_id, move):
-    resp = requests.post(f"{base_url}/api/live/{game_id}/move", json={"move": move})
+    resp = SESSION.post(f"{base_url}/api/live/{game_id}/move", json={"move": move})
     return resp.json()
 
 
 def find_best_move(engine, fen, depth):
     board = chess.Board(fen)
-    result = engine.play(board, chess.engine.Limit(depth=depth))
+    # One search gives both the move and its score
+    result = engine.play(board, chess.engine.Limit(depth=depth), info=chess.engine.INFO_SCORE)
     san = board.san(result.move)
     uci = result.move.uci()
 
-    info = engine.analyse(board, chess.engine.Limit(depth=depth))
-    score = info.get("score")
+    score = result.info.get("score")
     eval_str, eval_cp = "", 0
     if score:
         pov = score.white()
@@ -101,9 +157,7 @@ def main():
 
     try:
         move_count = 0
-        while move_count < args.max_moves:
-            state = get_state(args.url, game_id)
-
+        for state in watch_states(args.url, game_id):
             if state.get("error"):
                 print(f"❌ {state['error']}")
                 break
@@ -113,7 +167,6 @@ def main():
                 break
 
             if state.get("turn") != "black":
-                time.sleep(1)
                 continue
 
             fen = state["fen"]
@@ -145,6 +198,8 @@ def main():
                 break
 
             move_count += 1
+            if move_count >= args.max_moves:
+                break
             time.sleep(args.delay)
 
     except KeyboardInterrupt:
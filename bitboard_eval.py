@@ -0,0 +1,151 @@
+"""Numba-compiled static evaluation for autoplay_minimax over python-chess bitboards.
+
+``evaluate_bb`` scores material, piece-square tables, castling rights and
+mobility from the raw 64-bit integers every ``chess.Board`` already keeps
+(``occupied_co``, ``pawns``, ``knights``, ...), so a leaf evaluation is native
+integer bit arithmetic instead of walking Python piece objects.
+
+Mobility here is pseudo-legal (pins and check are ignored, castling and en
+passant are not counted), which is what makes it cheap to compute.
+
+Numba is optional: if it is not installed ``AVAILABLE`` is False and the bot
+keeps using its pure-Python evaluate().
+
+The material/PST numbers come from the caller (autoplay_minimax builds them),
+via ``make_evaluate_bb(piece_square_score)``.
+"""
+
+import chess
+
+try:
+    import numpy as np
+    from numba import njit
+except ImportError:
+    np = None
+    njit = None
+
+AVAILABLE = njit is not None
+
+
+def board_args(board: chess.Board):
+    """Arguments for evaluate_bb() taken straight from the board's bitboards."""
+    return (
+        board.occupied_co[chess.WHITE], board.occupied_co[chess.BLACK],
+        board.pawns, board.knights, board.bishops, board.rooks, board.queens, board.kings,
+        board.turn, board.castling_rights,
+    )
+
+
+if AVAILABLE:
+    KNIGHT_ATTACKS = np.array(chess.BB_KNIGHT_ATTACKS, dtype=np.uint64)
+    KING_ATTACKS = np.array(chess.BB_KING_ATTACKS, dtype=np.uint64)
+    # (file step, rank step) for bishops (first four) and rooks (last four)
+    DIRECTIONS = np.array([(1, 1), (1, -1), (-1, 1), (-1, -1), (1, 0), (-1, 0), (0, 1), (0, -1)], dtype=np.int64)
+
+    @njit(cache=True)
+    def _popcount(bb):
+        count = 0
+        while bb:
+            bb &= bb - np.uint64(1)
+            count += 1
+        return count
+
+    @njit(cache=True)
+    def _slider_moves(sq, own, occupied, first, last):
+        count = 0
+        for d in range(first, last):
+            f = sq % 8 + DIRECTIONS[d, 0]
+            r = sq // 8 + DIRECTIONS[d, 1]
+            while 0 <= f < 8 and 0 <= r < 8:
+                bit = np.uint64(1) << np.uint64(r * 8 + f)
+                if own & bit:
+                    break
+                count += 1
+                if occupied & bit:
+                    break
+                f += DIRECTIONS[d, 0]
+                r += DIRECTIONS[d, 1]
+        return count
+
+    @njit(cache=True)
+    def _kernel(table, white, black, pawns, knights, bishops, rooks, queens, kings, turn, castling):
+        occupied = white | black
+        own = white if turn else black
+        enemy = black if turn else white
+        score = 0
+        mobility = 0
+        for sq in range(64):
+            bit = np.uint64(1) << np.uint64(sq)
+            if not occupied & bit:
+                continue
+            color = 1 if white & bit else 0
+            if pawns & bit:
+                pt = 1
+            elif knights & bit:
+                pt = 2
+            elif bishops & bit:
+                pt = 3
+            elif rooks & bit:
+                pt = 4
+            elif queens & bit:
+                pt = 5
+            else:
+                pt = 6
+            score += table[color, pt, sq]
+
+            if not own & bit:
+                continue
+            if pt == 1:
+                step = 8 if turn else -8
+                rank = sq // 8
+                promo = 4 if (rank == 6 and turn) or (rank == 1 and not turn) else 1
+                ahead = sq + step
+                if not occupied & (np.uint64(1) << np.uint64(ahead)):
+                    mobility += promo
+                    if (rank == 1 and turn) or (rank == 6 and not turn):
+                        if not occupied & (np.uint64(1) << np.uint64(ahead + step)):
+                            mobility += 1
+                f = sq % 8
+                if f > 0 and enemy & (np.uint64(1) << np.uint64(ahead - 1)):
+                    mobility += promo
+                if f < 7 and enemy & (np.uint64(1) << np.uint64(ahead + 1)):
+                    mobility += promo
+            elif pt == 2:
+                mobility += _popcount(KNIGHT_ATTACKS[sq] & ~own)
+            elif pt == 3:
+                mobility += _slider_moves(sq, own, occupied, 0, 4)
+            elif pt == 4:
+                mobility += _slider_moves(sq, own, occupied, 4, 8)
+            elif pt == 5:
+                mobility += _slider_moves(sq, own, occupied, 0, 8)
+            else:
+                mobility += _popcount(KING_ATTACKS[sq] & ~own)
+
+        score += mobility * 2 if turn else -mobility * 2
+
+        # Castling rights are kept as the rook squares that may still castle
+        if castling & np.uint64(chess.BB_H1):
+            score += 15
+        if castling & np.uint64(chess.BB_A1):
+            score += 10
+        if castling & np.uint64(chess.BB_H8):
+            score -= 15
+        if castling & np.uint64(chess.BB_A8):
+            score -= 10
+        return score
+
+    def make_evaluate_bb(piece_square_score):
+        """Build evaluate_bb() over ``piece_square_score[color][piece_type][square]``
+        (signed material + PST, White positive)."""
+        table = np.zeros((2, 7, 64), dtype=np.int64)
+        for color in chess.COLORS:
+            for pt, row in piece_square_score[color].items():
+                table[int(color), pt] = row
+        u = np.uint64
+
+        def evaluate_bb(white, black, pawns, knights, bishops, rooks, queens, kings, turn, castling) -> int:
+            """Material + PST + mobility + castling rights in centipawns, White's perspective."""
+            return int(_kernel(table, u(white), u(black), u(pawns), u(knights), u(bishops), u(rooks),
+                               u(queens), u(kings), bool(turn), u(castling)))
+
+        return evaluate_bb
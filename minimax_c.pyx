@@ -0,0 +1,105 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+"""Cython build of autoplay_minimax.minimax.
+
+Same alpha-beta search as the Python version; depth, alpha, beta and scores are
+C ints and the recursion is a direct C call. The board stays a python-chess
+object, and evaluation, quiescence, move ordering and the transposition table
+are the ones from autoplay_minimax, handed over with bind().
+
+Build in place (needs Cython and a C compiler):
+  pip install cython && cythonize -i -3 minimax_c.pyx
+autoplay_minimax picks the compiled module up automatically when it imports.
+"""
+
+import chess.polyglot
+
+# Transposition-table bound flags, as in autoplay_minimax
+cdef enum:
+    EXACT = 0
+    LOWER = 1
+    UPPER = 2
+
+cdef object _evaluate = None
+cdef object _quiescence = None
+cdef object _order_moves = None
+cdef dict _tt = None
+cdef object _tt_store = None
+
+
+def bind(evaluate, quiescence, order_moves, tt, tt_store):
+    """Wire in autoplay_minimax's evaluation, ordering and transposition table."""
+    global _evaluate, _quiescence, _order_moves, _tt, _tt_store
+    _evaluate = evaluate
+    _quiescence = quiescence
+    _order_moves = order_moves
+    _tt = tt
+    _tt_store = tt_store
+
+
+cdef tuple _search(object board, int depth, int alpha, int beta, bint maximizing):
+    cdef int alpha_orig, beta_orig, tt_depth, flag, value, eval_score, best_eval
+    cdef object key, entry, tt_move, best_move, move
+
+    if board.is_game_over():
+        return _evaluate(board), None
+    if depth == 0:
+        return _quiescence(board, alpha, beta, maximizing), None
+
+    alpha_orig = alpha
+    beta_orig = beta
+    key = chess.polyglot.zobrist_hash(board)
+    tt_move = None
+    entry = _tt.get(key)
+    if entry:
+        tt_depth, flag, value, tt_move = entry
+        if tt_depth >= depth:
+            if flag == EXACT:
+                return value, tt_move
+            if flag == LOWER:
+                alpha = max(alpha, value)
+            else:
+                beta = min(beta, value)
+            if alpha >= beta:
+                return value, tt_move
+
+    best_move = None
+
+    if maximizing:
+        best_eval = alpha  # Fail-hard: scores outside the window are clamped to its bounds
+        for move in _order_moves(board, tt_move):
+            board.push(move)
+            eval_score = _search(board, depth - 1, alpha, beta, False)[0]
+            board.pop()
+            if eval_score > best_eval:
+                best_eval = eval_score
+                best_move = move
+            alpha = max(alpha, eval_score)
+            if beta <= alpha:
+                break  # Beta cutoff
+    else:
+        best_eval = beta
+        for move in _order_moves(board, tt_move):
+            board.push(move)
+            eval_score = _search(board, depth - 1, alpha, beta, True)[0]
+            board.pop()
+            if eval_score < best_eval:
+                best_eval = eval_score
+                best_move = move
+            beta = min(beta, eval_score)
+            if beta <= alpha:
+                break  # Alpha cutoff
+
+    if best_eval <= alpha_orig:
+        flag = UPPER
+    elif best_eval >= beta_orig:
+        flag = LOWER
+    else:
+        flag = EXACT
+    _tt_store(key, depth, flag, best_eval, best_move)
+    return best_eval, best_move
+
+
+def minimax(board, int depth, int alpha, int beta, bint maximizing):
+    """Minimax with alpha-beta pruning.
+    Returns (eval_score, best_move)."""
+    return _search(board, depth, alpha, beta, maximizing)
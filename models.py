@@ -1,45 +1,57 @@
-import json
+import math
 import chess
+import orjson
 from flask_sqlalchemy import SQLAlchemy
 
 db = SQLAlchemy()
 
 
-# Material values for win chance estimation
-_PIECE_VALUES = {
-    chess.PAWN: 1, chess.KNIGHT: 3, chess.BISHOP: 3.25,
-    chess.ROOK: 5, chess.QUEEN: 9,
-}
+# Material values for win chance estimation, in hundredths of a pawn
+_PAWN, _KNIGHT, _BISHOP, _ROOK, _QUEEN = 100, 300, 325, 500, 900
 
-def _estimate_win_chance(fen):
-    """Estimate White's win chance (0-100) from material balance.
-    Uses a sigmoid-like mapping: +3 pawns advantage ≈ 75%, +9 ≈ 95%."""
-    try:
-        board = chess.Board(fen)
-    except Exception:
-        return 50
+# Win chance for every material difference in [-40, +40] pawns, in hundredths;
+# beyond that the sigmoid is already saturated at 0/100
+_WIN_TABLE_LIMIT = 4000
+_WIN_TABLE = tuple(
+    max(0, min(100, round(50 + 50 * math.tanh(d / 100 / 6))))
+    for d in range(-_WIN_TABLE_LIMIT, _WIN_TABLE_LIMIT + 1)
+)
 
+def _estimate_win_chance(board):
+    """Estimate White's win chance (0-100) from material balance of a parsed board.
+    Uses a sigmoid-like mapping: +3 pawns advantage ≈ 75%, +9 ≈ 95%."""
     if board.is_checkmate():
         return 0 if board.turn == chess.WHITE else 100
     if board.is_game_over():
         return 50
 
-    white_material = sum(
-        _PIECE_VALUES.get(p.piece_type, 0)
-        for p in board.piece_map().values() if p.color == chess.WHITE
-    )
-    black_material = sum(
-        _PIECE_VALUES.get(p.piece_type, 0)
-        for p in board.piece_map().values() if p.color == chess.BLACK
+    # Popcounts straight off the bitboards, White positive
+    w, b = board.occupied_co[chess.WHITE], board.occupied_co[chess.BLACK]
+    diff = (
+        _PAWN * ((board.pawns & w).bit_count() - (board.pawns & b).bit_count())
+        + _KNIGHT * ((board.knights & w).bit_count() - (board.knights & b).bit_count())
+        + _BISHOP * ((board.bishops & w).bit_count() - (board.bishops & b).bit_count())
+        + _ROOK * ((board.rooks & w).bit_count() - (board.rooks & b).bit_count())
+        + _QUEEN * ((board.queens & w).bit_count() - (board.queens & b).bit_count())
     )
-    diff = white_material - black_material
-    # Sigmoid: 50 + 50 * tanh(diff / 6)
-    import math
-    win_chance = 50 + 50 * math.tanh(diff / 6)
-    return max(0, min(100, round(win_chance)))
+    # Sigmoid: 50 + 50 * tanh(diff / 6), precomputed
+    return _WIN_TABLE[max(-_WIN_TABLE_LIMIT, min(_WIN_TABLE_LIMIT, diff)) + _WIN_TABLE_LIMIT]
+
+
+class HistoryMixin:
+    """Parse the JSON ``history`` column once per stored value instead of on every to_dict()."""
+
+    @property
+    def history_list(self):
+        # Cached against the exact string object, so assigning a new history invalidates it
+        cached = self.__dict__.get("_history_cache")
+        if cached is None or cached[0] is not self.history:
+            cached = (self.history, orjson.loads(self.history))
+            self.__dict__["_history_cache"] = cached
+        return cached[1]
 
 
-class LiveGame(db.Model):
+class LiveGame(HistoryMixin, db.Model):
     id = db.Column(db.String(8), primary_key=True)
     fen = db.Column(db.String(100), nullable=False, default='rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1')
     history = db.Column(db.Text, nullable=False, default='[]')
@@ -52,15 +64,16 @@ class LiveGame(db.Model):
     updated_at = db.Column(db.DateTime, default=db.func.now(), onupdate=db.func.now())
 
     def to_dict(self):
-        history = json.loads(self.history)
-        # Determine turn from FEN (more reliable than history length)
+        history = self.history_list
+        # Determine turn from FEN (more reliable than history length); parsed once
+        # and reused for the win chance
         try:
             board = chess.Board(self.fen)
             turn = "white" if board.turn == chess.WHITE else "black"
+            win_chance = _estimate_win_chance(board)
         except Exception:
             turn = "white" if len(history) % 2 == 0 else "black"
-
-        win_chance = _estimate_win_chance(self.fen)
+            win_chance = 50
 
         d = {
             "id": self.id,
@@ -79,14 +92,24 @@ class LiveGame(db.Model):
         return d
 
 
-class Game(db.Model):
+class Game(HistoryMixin, db.Model):
+    # Serve per-session lookups and listings from the index, without a sort
+    __table_args__ = (
+        db.Index("ix_game_session_id_id", "session_id", "id"),
+        db.Index("ix_game_session_created", "session_id", "created_at"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     session_id = db.Column(db.String(36), nullable=False, index=True)
     name = db.Column(db.String(100), nullable=False, default="")
-    date = db.Column(db.String(50), nullable=False)
+    date = db.Column(db.String(50), nullable=False)  # Client-formatted display label
+    created_at = db.Column(db.DateTime, default=db.func.now())
     moves = db.Column(db.Text, nullable=False)
     history = db.Column(db.Text, nullable=False)  # JSON array of move strings
     move_count = db.Column(db.Integer, nullable=False)
+    batch_id = db.Column(db.String(64), nullable=True)  # OpenAI batch for post-game annotation
+    batch_status = db.Column(db.String(20), nullable=True)
+    annotations = db.Column(db.Text, nullable=True)  # JSON array, one analysis per ply
 
     def to_dict(self):
         return {
@@ -94,6 +117,14 @@ class Game(db.Model):
             "name": self.name,
             "date": self.date,
             "moves": self.moves,
-            "history": json.loads(self.history),
+            "history": self.history_list,
             "moveCount": self.move_count,
+            "createdAt": self.created_at.isoformat() if self.created_at else None,
         }
+
+
+class AnalysisCache(db.Model):
+    """/api/analyze payloads shared by every web and Celery worker process."""
+    key = db.Column(db.String(64), primary_key=True)  # sha256 of FEN, prompt history and model
+    analysis = db.Column(db.Text, nullable=False)  # JSON payload
+    created_at = db.Column(db.DateTime, default=db.func.now())
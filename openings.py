@@ -0,0 +1,75 @@
+"""Tiny ECO opening book used to answer well-known opening positions without an LLM call.
+
+Each entry is the line played so far (SAN, from the start position), the
+ECO code and name of the opening it reaches, the book reply for the side to
+move, and a one-line plan shown as the explanation.
+"""
+
+import chess
+
+OPENING_LINES = [
+    ("", "B00", "King's Pawn Opening", "e4",
+     "Occupies the centre and opens lines for the queen and the king's bishop."),
+    ("e4", "C20", "King's Pawn Game", "e5",
+     "Mirrors White's claim on the centre and frees Black's kingside pieces."),
+    ("e4 e5", "C40", "King's Knight Opening", "Nf3",
+     "Develops with tempo by attacking e5 and prepares to castle kingside."),
+    ("e4 e5 Nf3", "C44", "King's Knight Opening", "Nc6",
+     "Defends e5 while developing a knight toward the centre."),
+    ("e4 e5 Nf3 Nc6", "C60", "Ruy Lopez", "Bb5",
+     "Pressures the knight that defends e5, the start of the Ruy Lopez."),
+    ("e4 e5 Nf3 Nc6 Bb5", "C68", "Ruy Lopez, Morphy Defence", "a6",
+     "Puts the question to the bishop straight away and gains queenside space."),
+    ("e4 e5 Nf3 Nc6 Bc4", "C50", "Italian Game", "Bc5",
+     "Develops the bishop to its most active diagonal, eyeing f2."),
+    ("e4 c5", "B27", "Sicilian Defence", "Nf3",
+     "Flexible development that prepares d4 to open the centre."),
+    ("e4 c5 Nf3", "B50", "Sicilian Defence", "d6",
+     "Controls e5 and prepares ...Nf6 before White plays d4."),
+    ("e4 e6", "C00", "French Defence", "d4",
+     "Builds the full pawn centre that the French sets out to challenge."),
+    ("e4 e6 d4", "C00", "French Defence", "d5",
+     "Strikes at e4 immediately, the main idea of the French."),
+    ("e4 c6", "B10", "Caro-Kann Defence", "d4",
+     "Takes the whole centre while Black prepares ...d5."),
+    ("e4 c6 d4", "B12", "Caro-Kann Defence", "d5",
+     "Challenges e4 with a pawn chain that keeps the light-squared bishop free."),
+    ("d4", "D00", "Queen's Pawn Game", "d5",
+     "Stops White from taking the centre with e4 unopposed."),
+    ("d4 d5", "D06", "Queen's Gambit", "c4",
+     "Offers a wing pawn to deflect Black's d-pawn from the centre."),
+    ("d4 d5 c4", "D30", "Queen's Gambit Declined", "e6",
+     "Keeps a solid hold on d5 and opens the way for the dark-squared bishop."),
+    ("d4 Nf6", "A50", "Indian Defence", "c4",
+     "Gains queenside space and discourages ...d5."),
+    ("d4 Nf6 c4", "E00", "Indian Defence", "e6",
+     "Keeps options open for the Nimzo-Indian, Queen's Indian or a Queen's Gambit."),
+    ("c4", "A20", "English Opening", "e5",
+     "A reversed Sicilian set-up that contests d4 directly."),
+    ("Nf3", "A06", "Reti Opening", "d5",
+     "Claims the centre with a pawn before White commits to a structure."),
+]
+
+
+def _position_key(board):
+    # EPD only records an en passant square when the capture is legal, so
+    # boards built from a FEN and boards built by pushing moves agree
+    return board.epd()
+
+
+def _build_book():
+    book = {}
+    for line, eco, name, reply, plan in OPENING_LINES:
+        board = chess.Board()
+        for san in line.split():
+            board.push_san(san)
+        book[_position_key(board)] = (eco, name, board.parse_san(reply), plan)
+    return book
+
+
+_BOOK = _build_book()
+
+
+def lookup(board):
+    """Return (eco, name, book_move, plan) for a known opening position, or None."""
+    return _BOOK.get(_position_key(board))
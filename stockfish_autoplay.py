@@ -5,19 +5,28 @@ Usage: python3 stockfish_autoplay.py <game_id> [--depth 20] [--delay 5] [--url h
 """
 
 import argparse
-import json
+import asyncio
 import math
+import os
 import subprocess
 import sys
-import time
 
 import chess
 import chess.engine
-import requests
+import httpx
+import orjson
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 DEFAULT_URL = "https://chessguardian-production.up.railway.app"
 DEFAULT_DEPTH = 20
 DEFAULT_DELAY = 5  # seconds between moves (enough to see turn changes)
+# A single engine gets the machine; STOCKFISH_THREADS / STOCKFISH_HASH override
+STOCKFISH_THREADS = int(os.getenv("STOCKFISH_THREADS", str(max(1, (os.cpu_count() or 2) - 1))))
+STOCKFISH_HASH = int(os.getenv("STOCKFISH_HASH", "256"))  # MB
 
 
 def get_stockfish():
@@ -26,7 +35,8 @@ def get_stockfish():
     for path in paths:
         try:
             engine = chess.engine.SimpleEngine.popen_uci(path)
-            print(f"✅ Stockfish loaded: {path}")
+            engine.configure({"Threads": STOCKFISH_THREADS, "Hash": STOCKFISH_HASH})
+            print(f"✅ Stockfish loaded: {path} ({STOCKFISH_THREADS} threads, {STOCKFISH_HASH} MB hash)")
             return engine
         except Exception:
             continue
@@ -34,29 +44,133 @@ def get_stockfish():
     sys.exit(1)
 
 
-def get_game_state(base_url, game_id):
-    """Poll the live game state."""
-    resp = requests.get(f"{base_url}/api/live/{game_id}")
+def make_client(base_url):
+    """One keep-alive HTTP client reused for every request to the server.
+
+    Failed connection attempts are retried (the request was never sent, so this
+    is safe for POSTed moves too), and HTTP/2 lets the event stream and the
+    move requests share one TLS connection where the server offers it."""
+    transport = httpx.AsyncHTTPTransport(
+        retries=3,
+        http2=True,
+        limits=httpx.Limits(max_connections=8, max_keepalive_connections=8, keepalive_expiry=30),
+    )
+    return httpx.AsyncClient(
+        base_url=base_url,
+        transport=transport,
+        timeout=httpx.Timeout(35.0, connect=10.0),
+    )
+
+
+async def get_game_state(client, game_id, since=None):
+    """Fetch the live game state. With ``since`` (a ply count) the server long-polls
+    until the game has moved past it."""
+    params = {"since": since} if since is not None else None
+    while True:
+        resp = await client.get(f"/api/live/{game_id}", params=params)
+        if resp.status_code != 503:
+            break
+        # The server is holding as many waiting connections as it allows
+        await asyncio.sleep(float(resp.headers.get("Retry-After", 2)))
     resp.raise_for_status()
-    return resp.json()
+    return orjson.loads(resp.content)
 
 
-def make_move(base_url, game_id, move_san):
+async def watch_states(client, game_id):
+    """Yield the game state every time it changes.
+
+    Follows the server-sent event stream at /api/live/<id>/events and reconnects
+    when the server ends it. Servers without the stream are long-polled instead."""
+    while True:
+        try:
+            async with client.stream("GET", f"/api/live/{game_id}/events",
+                                     timeout=httpx.Timeout(60.0, connect=10.0)) as resp:
+                if resp.status_code == 503:
+                    await asyncio.sleep(float(resp.headers.get("Retry-After", 2)))
+                    continue
+                if resp.status_code != 200:
+                    break
+                async for line in resp.aiter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    state = orjson.loads(line[len("data: "):])
+                    yield state
+                    if state.get("gameOver"):
+                        return
+        except httpx.HTTPError:
+            await asyncio.sleep(1)
+
+    state = await get_game_state(client, game_id)
+    while True:
+        yield state
+        if state.get("error") or state.get("gameOver"):
+            return
+        state = await get_game_state(client, game_id, since=len(state.get("history", [])))
+
+
+async def make_move(client, game_id, move_san):
     """Submit a move to the live game."""
-    resp = requests.post(
-        f"{base_url}/api/live/{game_id}/move",
+    resp = await client.post(
+        f"/api/live/{game_id}/move",
         json={"move": move_san},
     )
-    return resp.json()
+    return orjson.loads(resp.content)
+
+
+def sync_board(board, plies, fen, history):
+    """Push the moves the server played after ply ``plies`` onto the kept board,
+    so Stockfish sees one continuing game (repetitions included) without a FEN
+    parse per turn. Resets to ``fen`` only if the two have diverged.
+    Returns the new ply count."""
+    if len(history) >= plies:
+        try:
+            for san in history[plies:]:
+                board.push_san(san)
+        except ValueError:
+            pass
+    if board.fen() != fen:
+        board.set_fen(fen)
+    return len(history)
+
+
+# Early exit from the depth-limited search: a short forced mate, or a score that
+# has held within STABLE_CP for STABLE_DEPTHS iterations once past 2/3 of the depth
+EARLY_MATE = 5
+STABLE_CP = 30
+STABLE_DEPTHS = 3
+
+
+def search(engine, board, depth):
+    """Run Stockfish's iterative deepening up to ``depth`` and return (move, score),
+    stopping as soon as a deeper search is unlikely to change the answer."""
+    min_depth = max(1, depth * 2 // 3)
+    best_move, best_score = None, None
+    scores = {}  # depth -> side-to-move centipawns of its latest full line
+    with engine.analysis(board, chess.engine.Limit(depth=depth)) as analysis:
+        for info in analysis:
+            # Only full lines count; bound-only updates come mid-iteration
+            if "pv" not in info or "score" not in info or info.get("lowerbound") or info.get("upperbound"):
+                continue
+            best_move, best_score = info["pv"][0], info["score"]
+            relative = best_score.relative
+            if relative.is_mate():
+                if abs(relative.mate()) <= EARLY_MATE:
+                    break
+                continue
+            scores[info.get("depth", 0)] = relative.score()
+            recent = list(scores.values())[-STABLE_DEPTHS:]
+            if (info.get("depth", 0) >= min_depth and len(recent) == STABLE_DEPTHS
+                    and max(recent) - min(recent) < STABLE_CP):
+                break
+        else:
+            best_move = analysis.wait().move or best_move
+    return best_move, best_score
 
 
-def find_best_move(engine, fen, depth):
+def find_best_move(engine, board, depth):
     """Use Stockfish to find the best move."""
-    board = chess.Board(fen)
-    result = engine.play(board, chess.engine.Limit(depth=depth))
-    san = board.san(result.move)
-    info = engine.analyse(board, chess.engine.Limit(depth=depth))
-    score = info.get("score")
+    move, score = search(engine, board, depth)
+    san = board.san(move)
     eval_str = ""
     eval_cp = 0
     if score:
@@ -67,7 +181,7 @@ def find_best_move(engine, fen, depth):
         else:
             eval_cp = pov.score()
             eval_str = f"{eval_cp / 100:+.2f}"
-    return san, result.move.uci(), eval_str, eval_cp
+    return san, move.uci(), eval_str, eval_cp
 
 
 def eval_to_win_pct(cp):
@@ -75,6 +189,14 @@ def eval_to_win_pct(cp):
     return max(0, min(100, round(50 + 50 * math.tanh(cp / 600))))
 
 
+def evals_to_win_pct(cps):
+    """eval_to_win_pct over a whole game's scores at once (int8 array with NumPy)."""
+    if np is None:
+        return [eval_to_win_pct(cp) for cp in cps]
+    cps = np.asarray(cps, dtype=np.float64)
+    return np.clip(np.round(50 + 50 * np.tanh(cps / 600.0)), 0, 100).astype(np.int8)
+
+
 # --- Notification callback (optional) ---
 _notify_fn = None
 
@@ -91,28 +213,15 @@ def notify(msg):
             print(f"  ⚠️ Notify error: {e}")
 
 
-def main():
-    parser = argparse.ArgumentParser(description="Stockfish autoplay for ChessGuardian")
-    parser.add_argument("game_id", help="Live game ID")
-    parser.add_argument("--depth", type=int, default=DEFAULT_DEPTH, help=f"Stockfish depth (default: {DEFAULT_DEPTH})")
-    parser.add_argument("--delay", type=float, default=DEFAULT_DELAY, help=f"Delay between moves in seconds (default: {DEFAULT_DELAY})")
-    parser.add_argument("--url", default=DEFAULT_URL, help=f"ChessGuardian base URL (default: {DEFAULT_URL})")
-    parser.add_argument("--max-moves", type=int, default=200, help="Max moves before stopping (default: 200)")
-    args = parser.parse_args()
-
-    print(f"♟️  Stockfish Autoplay — Game {args.game_id}")
-    print(f"   URL: {args.url}")
-    print(f"   Depth: {args.depth} | Delay: {args.delay}s | Max moves: {args.max_moves}")
-    print(f"   Live: {args.url}/live/{args.game_id}")
-    print()
-
-    engine = get_stockfish()
-
-    try:
+async def play(args, engine):
+    async with make_client(args.url) as client:
         move_count = 0
-        while move_count < args.max_moves:
-            state = get_game_state(args.url, args.game_id)
-
+        pause = 0
+        moved_from = None
+        black_cps = []  # Black-POV eval of every move played, for the end-of-game curve
+        board = chess.Board()
+        plies = 0
+        async for state in watch_states(client, args.game_id):
             if state.get("error"):
                 notify(f"❌ Error: {state['error']}")
                 break
@@ -126,22 +235,28 @@ def main():
             turn = state.get("turn", "unknown")
             history = state.get("history", [])
 
-            if turn != "black":
-                time.sleep(1)
+            # A reconnect re-sends the current state; never move twice from one position
+            if turn != "black" or fen == moved_from:
                 continue
-
-            san, uci, eval_str, eval_cp = find_best_move(engine, fen, args.depth)
+            moved_from = fen
+            plies = sync_board(board, plies, fen, history)
+
+            # The engine thinks while the delay after the previous move runs out
+            (san, uci, eval_str, eval_cp), _ = await asyncio.gather(
+                asyncio.to_thread(find_best_move, engine, board, args.depth),
+                asyncio.sleep(pause),
+            )
             move_num = len(history) // 2 + 1
-            win_pct = eval_to_win_pct(-eval_cp)  # From Black's perspective
+            black_cps.append(-eval_cp)
 
             move_msg = f"♟️ {move_num}... {san}  (eval: {eval_str} | Black win: {100 - eval_to_win_pct(eval_cp)}%)"
             notify(move_msg)
 
-            result = make_move(args.url, args.game_id, san)
+            result = await make_move(client, args.game_id, san)
 
             if result.get("error"):
                 notify(f"  ❌ Move rejected: {result['error']}")
-                result = make_move(args.url, args.game_id, uci)
+                result = await make_move(client, args.game_id, uci)
                 if result.get("error"):
                     notify(f"  ❌ Still rejected: {result['error']}")
                     break
@@ -165,8 +280,34 @@ def main():
                 break
 
             move_count += 1
-            time.sleep(args.delay)
+            if move_count >= args.max_moves:
+                break
+            pause = args.delay
+
+        if black_cps:
+            curve = " ".join(str(int(pct)) for pct in evals_to_win_pct(black_cps))
+            notify(f"📈 Black win % by move: {curve}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stockfish autoplay for ChessGuardian")
+    parser.add_argument("game_id", help="Live game ID")
+    parser.add_argument("--depth", type=int, default=DEFAULT_DEPTH, help=f"Stockfish depth (default: {DEFAULT_DEPTH})")
+    parser.add_argument("--delay", type=float, default=DEFAULT_DELAY, help=f"Delay between moves in seconds (default: {DEFAULT_DELAY})")
+    parser.add_argument("--url", default=DEFAULT_URL, help=f"ChessGuardian base URL (default: {DEFAULT_URL})")
+    parser.add_argument("--max-moves", type=int, default=200, help="Max moves before stopping (default: 200)")
+    args = parser.parse_args()
 
+    print(f"♟️  Stockfish Autoplay — Game {args.game_id}")
+    print(f"   URL: {args.url}")
+    print(f"   Depth: {args.depth} | Delay: {args.delay}s | Max moves: {args.max_moves}")
+    print(f"   Live: {args.url}/live/{args.game_id}")
+    print()
+
+    engine = get_stockfish()
+
+    try:
+        asyncio.run(play(args, engine))
     except KeyboardInterrupt:
         notify("\n⏹️ Stopped by user")
     finally:
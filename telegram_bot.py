@@ -1,17 +1,28 @@
 import asyncio
-import json
 import logging
+import math
+import multiprocessing
 import os
+import re
+import threading
+from array import array
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass, field
+from functools import partial, wraps
 from io import BytesIO
-from typing import Dict, Optional
+from typing import Callable, Dict, Optional
 
 import cairosvg
 import chess
+import chess.engine
+import chess.polyglot
 import chess.svg
+import orjson
+from cachetools import LRUCache
 from dotenv import load_dotenv
 from openai import OpenAI
-from stockfish import Stockfish as StockfishEngine
+from PIL import Image, ImageDraw, ImageFont
 from telegram import InputFile, Update
 from telegram.ext import Application, CommandHandler, ContextTypes
 
@@ -27,9 +38,9 @@ SYSTEM_PROMPT = """You are an expert chess analyst. When given a chess position
 
 {
   "bestMove": "Piece from [square] to [square] (notation)",
-  "explanation": "2-3 sentence explanation of why this move is best",
   "evaluation": "Short position assessment, e.g. White is slightly better",
-  "winChance": 55
+  "winChance": 55,
+  "explanation": "2-3 sentence explanation of why this move is best"
 }
 
 Rules:
@@ -44,42 +55,168 @@ STOCKFISH_PATH = os.getenv(
 )
 STOCKFISH_SKILL = int(os.getenv("STOCKFISH_SKILL", "10"))
 STOCKFISH_DEPTH = int(os.getenv("STOCKFISH_DEPTH", "12"))
+# Every active chat runs its own engine, so keep threads low unless there are few chats
+STOCKFISH_THREADS = int(os.getenv("STOCKFISH_THREADS", "1"))
+STOCKFISH_HASH = int(os.getenv("STOCKFISH_HASH", "128"))  # MB per engine
+
+# Optional Polyglot book (memory-mapped, shared by every chat) answered before Stockfish
+OPENING_BOOK_PATH = os.getenv("OPENING_BOOK_PATH", "data/book.bin")
+opening_book = chess.polyglot.open_reader(OPENING_BOOK_PATH) if os.path.isfile(OPENING_BOOK_PATH) else None
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 
-@dataclass
+@dataclass(slots=True)
 class ChatGame:
     board: chess.Board = field(default_factory=chess.Board)
-    history: list[str] = field(default_factory=list)
+    # Moves packed two bytes each: from | to << 6 | promotion << 12
+    moves: array = field(default_factory=lambda: array("H"))
     status: str = "active"
     result: Optional[str] = None
+    # Stockfish process kept for the whole game so its hash tables stay warm
+    engine: Optional[chess.engine.SimpleEngine] = None
+
+    def push(self, move: chess.Move) -> None:
+        """Play a move on the board and record it."""
+        self.board.push(move)
+        self.moves.append(move.from_square | move.to_square << 6 | (move.promotion or 0) << 12)
+
+    @property
+    def history(self) -> list[str]:
+        """SAN move list, rebuilt from the packed moves when it is needed."""
+        board = chess.Board()
+        history = []
+        for packed in self.moves:
+            move = chess.Move(packed & 63, packed >> 6 & 63, packed >> 12 or None)
+            history.append(board.san(move))
+            board.push(move)
+        return history
 
 
 # In-memory chat state keyed by Telegram chat_id.
 GAMES: Dict[int, ChatGame] = {}
 
+# Updates are handled concurrently; each chat's commands still run one at a time
+CHAT_LOCKS: Dict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+
+def one_at_a_time(handler):
+    """Run a command handler under its chat's lock, so a double-tapped /move
+    can't push onto a board another command is still using."""
+    @wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        async with CHAT_LOCKS[update.effective_chat.id]:
+            await handler(update, context)
+    return wrapper
+
+# Position caches shared by all chats, keyed by board._transposition_key()
+POSITION_CACHE_SIZE = int(os.getenv("POSITION_CACHE_SIZE", "8192"))
+_move_cache = LRUCache(maxsize=POSITION_CACHE_SIZE)
+_analysis_cache = LRUCache(maxsize=POSITION_CACHE_SIZE)
+_cache_lock = threading.Lock()
+
+
+def cache_get(cache, key):
+    with _cache_lock:
+        return cache.get(key)
+
+
+def cache_put(cache, key, value):
+    with _cache_lock:
+        cache[key] = value
+
+
+def get_engine(game: ChatGame) -> chess.engine.SimpleEngine:
+    """Return the game's Stockfish process, starting and configuring it on first use."""
+    if game.engine is None:
+        engine = chess.engine.SimpleEngine.popen_uci(STOCKFISH_PATH)
+        engine.configure({
+            "Skill Level": STOCKFISH_SKILL,
+            "Hash": STOCKFISH_HASH,
+            "Threads": STOCKFISH_THREADS,
+        })
+        game.engine = engine
+    return game.engine
+
+
+def close_engine(game: Optional[ChatGame]) -> None:
+    """Shut down a finished game's Stockfish process."""
+    if game and game.engine is not None:
+        engine, game.engine = game.engine, None
+        try:
+            engine.quit()
+        except chess.engine.EngineError:
+            logger.warning("Stockfish did not quit cleanly", exc_info=True)
+
+
+def stockfish_best_move(game: ChatGame) -> tuple[Optional[chess.Move], Optional[str]]:
+    """Return Stockfish best move for the game's position as (move, SAN)."""
+    board = game.board
+    if opening_book:
+        try:
+            move = opening_book.weighted_choice(board).move
+            return move, board.san(move)
+        except IndexError:
+            pass
+
+    # The engine sees the whole move stack: key on the fifty-move clock too, and
+    # don't share replies for positions that have already occurred before
+    cacheable = not board.is_repetition(2)
+    key = (board._transposition_key(), min(board.halfmove_clock, 100))
+    move = cache_get(_move_cache, key) if cacheable else None
+    if move is None:
+        move = get_engine(game).play(board, chess.engine.Limit(depth=STOCKFISH_DEPTH)).move
+        if move and cacheable:
+            cache_put(_move_cache, key, move)
+    if not move or not board.is_legal(move):
+        return None, None
+    return move, board.san(move)
 
-def get_stockfish() -> StockfishEngine:
-    """Create a new Stockfish instance for one move calculation."""
-    sf = StockfishEngine(path=STOCKFISH_PATH, depth=STOCKFISH_DEPTH)
-    sf.update_engine_parameters({"Skill Level": STOCKFISH_SKILL})
-    return sf
 
+def analyze_game(game: ChatGame) -> dict:
+    """analyze_position for the game's current position, using the game's engine."""
+    return analyze_position(game.board, lambda: game.history, get_engine(game))
 
-def stockfish_best_move(board: chess.Board) -> tuple[Optional[chess.Move], Optional[str]]:
-    """Return Stockfish best move as (move, SAN)."""
-    sf = get_stockfish()
-    sf.set_fen_position(board.fen())
-    best_uci = sf.get_best_move()
-    if not best_uci:
-        return None, None
 
-    move = chess.Move.from_uci(best_uci)
-    if move not in board.legal_moves:
-        return None, None
-    return move, board.san(move)
+ANALYZE_MAX_POSITIONS = 5
+
+
+def _position_label(san: Optional[str], ply: int) -> str:
+    if ply == 0:
+        return "Start position"
+    return f"After {(ply + 1) // 2}{'.' if ply % 2 else '...'} {san}"
+
+
+def analyze_recent(game: ChatGame, count: int) -> list[tuple[str, dict]]:
+    """Analyses of the game's last ``count`` positions, oldest first, batched
+    through analyze_positions."""
+    full_history: list[str] = []
+
+    def history_to(ply: int) -> list[str]:
+        # Only replayed if OpenAI is asked, and then only once for all positions
+        if not full_history:
+            full_history.extend(game.history)
+        return full_history[:ply]
+
+    board = game.board.copy()
+    plies = len(board.move_stack)
+    labels, boards, histories = [], [], []
+    for back in range(min(count, plies + 1)):
+        ply = plies - back
+        position = board.copy()
+        san = None
+        if ply:
+            move = board.pop()
+            san = board.san(move)
+        if not position.is_game_over(claim_draw=True):
+            labels.append(_position_label(san, ply))
+            boards.append(position)
+            histories.append(partial(history_to, ply))
+    # A finished game's engine has been shut down; don't start a new one for it
+    engine = get_engine(game) if game.status == "active" else None
+    analyses = analyze_positions(boards, histories, engine)
+    return list(zip(labels, analyses))[::-1]
 
 
 def parse_user_move(board: chess.Board, move_text: str) -> Optional[chess.Move]:
@@ -90,14 +227,14 @@ def parse_user_move(board: chess.Board, move_text: str) -> Optional[chess.Move]:
 
     try:
         move = board.parse_san(move_text)
-        if move in board.legal_moves:
+        if board.is_legal(move):
             return move
     except (chess.InvalidMoveError, chess.IllegalMoveError, chess.AmbiguousMoveError):
         pass
 
     try:
         move = chess.Move.from_uci(move_text)
-        if move in board.legal_moves:
+        if board.is_legal(move):
             return move
     except (ValueError, chess.InvalidMoveError):
         pass
@@ -107,50 +244,129 @@ def parse_user_move(board: chess.Board, move_text: str) -> Optional[chess.Move]:
 
 def check_game_over(board: chess.Board) -> tuple[bool, str, int]:
     """Return (is_over, status_text, white_win_chance)."""
-    if board.is_checkmate():
-        winner = "Black" if board.turn == chess.WHITE else "White"
+    # One outcome() call replaces separate checkmate/stalemate/material/claim scans
+    outcome = board.outcome(claim_draw=True)
+    if outcome is None:
+        return False, "", 50
+
+    result = outcome.result()
+    if outcome.termination == chess.Termination.CHECKMATE:
+        winner = "White" if outcome.winner == chess.WHITE else "Black"
         win_chance = 100 if winner == "White" else 0
-        return True, f"Checkmate. {winner} wins ({board.result()}).", win_chance
+        return True, f"Checkmate. {winner} wins ({result}).", win_chance
 
-    if board.is_stalemate():
-        return True, f"Stalemate. Draw ({board.result()}).", 50
+    if outcome.termination == chess.Termination.STALEMATE:
+        return True, f"Stalemate. Draw ({result}).", 50
 
-    if board.is_insufficient_material():
-        return True, f"Draw by insufficient material ({board.result()}).", 50
+    if outcome.termination == chess.Termination.INSUFFICIENT_MATERIAL:
+        return True, f"Draw by insufficient material ({result}).", 50
 
-    if board.can_claim_fifty_moves() or board.can_claim_threefold_repetition():
-        return True, f"Draw can be claimed ({board.result(claim_draw=True)}).", 50
+    return True, f"Draw can be claimed ({result}).", 50
 
-    return False, "", 50
 
+def describe_move(board: chess.Board, move: chess.Move) -> str:
+    """Spell a move out the way the analysis prompt asks for, e.g. "Knight from g1 to f3 (Nf3)"."""
+    san = board.san(move)
+    if board.is_castling(move):
+        side = "kingside" if board.is_kingside_castling(move) else "queenside"
+        return f"King castles {side} ({san})"
+    piece = chess.piece_name(board.piece_type_at(move.from_square)).capitalize()
+    return f"{piece} from {chess.square_name(move.from_square)} to {chess.square_name(move.to_square)} ({san})"
 
-def analyze_position(board: chess.Board, move_history: list[str]) -> dict:
-    """Analyze board with OpenAI and return normalized analysis fields."""
-    side_to_move = "White" if board.turn == chess.WHITE else "Black"
-    legal_moves = " ".join(board.san(m) for m in board.legal_moves)
 
-    user_message = (
-        f"Position (FEN): {board.fen()}\n"
-        f"It is {side_to_move}'s turn to move. Suggest the best move for {side_to_move}."
-    )
-    user_message += f"\nLegal moves: {legal_moves}"
-    user_message += "\nIMPORTANT: You MUST recommend one of the legal moves listed above."
-    if move_history:
-        user_message += f"\nMove history: {' '.join(move_history)}"
-
-    response = client.chat.completions.create(
-        model=OPENAI_MODEL,
-        messages=[
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": user_message},
-        ],
-        max_tokens=500,
-        response_format={"type": "json_object"},
-    )
+def engine_analysis(board: chess.Board, engine: chess.engine.SimpleEngine) -> Optional[dict]:
+    """Analysis fields from one MultiPV=2 search: best move and score from the
+    first line, the second line to flag positions with two near-equal moves."""
+    lines = engine.analyse(board, chess.engine.Limit(depth=STOCKFISH_DEPTH), multipv=2)
+    if not lines or not lines[0].get("pv"):
+        return None
 
-    raw = response.choices[0].message.content.strip()
-    parsed = json.loads(raw)
+    score = lines[0]["score"].white()
+    if score.is_mate():
+        winner = "White" if score.mate() > 0 else "Black"
+        evaluation = f"{winner} mates in {abs(score.mate())}"
+        win_chance = 100 if score.mate() > 0 else 0
+    else:
+        cp = score.score()
+        evaluation = f"{cp / 100:+.2f}"
+        win_chance = max(0, min(100, round(50 + 50 * math.tanh(cp / 600))))
+
+    if len(lines) > 1 and lines[1].get("pv") and not score.is_mate():
+        second = lines[1]["score"].white()
+        if not second.is_mate() and abs(second.score() - score.score()) <= 20:
+            evaluation += f" ({board.san(lines[1]['pv'][0])} is about as good)"
 
+    return {
+        "bestMove": describe_move(board, lines[0]["pv"][0]),
+        "explanation": "",
+        "evaluation": evaluation,
+        "winChance": win_chance,
+    }
+
+
+def _local_analysis(board: chess.Board, engine: Optional[chess.engine.SimpleEngine]) -> Optional[dict]:
+    """A cached analysis, or one from the engine; None when OpenAI has to be asked."""
+    key = board._transposition_key()
+    cached = cache_get(_analysis_cache, key)
+    if cached is not None:
+        return dict(cached)
+
+    if engine is not None:
+        try:
+            analysis = engine_analysis(board, engine)
+        except chess.engine.EngineError:
+            logger.warning("Stockfish analysis failed, asking OpenAI", exc_info=True)
+            analysis = None
+        if analysis:
+            cache_put(_analysis_cache, key, analysis)
+            return dict(analysis)
+    return None
+
+
+# Cap on OpenAI requests in flight across all chats (they run in worker threads)
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "4"))
+_openai_slots = threading.BoundedSemaphore(OPENAI_MAX_CONCURRENCY)
+
+# Token cap per analysed position; the fields the bot shows need well under this
+ANALYSIS_MAX_TOKENS = 180
+_STREAM_FIELDS = re.compile(
+    r'"bestMove"\s*:\s*("(?:[^"\\]|\\.)*")'
+    r'.*?"evaluation"\s*:\s*("(?:[^"\\]|\\.)*")'
+    r'.*?"winChance"\s*:\s*(\d+)\s*[,}]',
+    re.S,
+)
+
+
+def _stream_analysis(messages: list[dict]) -> dict:
+    """Stream one analysis completion and stop reading as soon as bestMove,
+    evaluation and winChance are in; the trailing explanation is never shown."""
+    with _openai_slots:
+        stream = client.chat.completions.create(
+            model=OPENAI_MODEL,
+            messages=messages,
+            max_tokens=ANALYSIS_MAX_TOKENS,
+            response_format={"type": "json_object"},
+            stream=True,
+        )
+        buf = ""
+        try:
+            for chunk in stream:
+                if chunk.choices:
+                    buf += chunk.choices[0].delta.content or ""
+                fields = _STREAM_FIELDS.search(buf)
+                if fields:
+                    best_move, evaluation, win_chance = fields.groups()
+                    return {
+                        "bestMove": orjson.loads(best_move),
+                        "evaluation": orjson.loads(evaluation),
+                        "winChance": int(win_chance),
+                    }
+        finally:
+            stream.close()
+    return orjson.loads(buf)
+
+
+def _normalize_analysis(parsed: dict) -> dict:
     return {
         "bestMove": parsed.get("bestMove", ""),
         "explanation": parsed.get("explanation", ""),
@@ -159,11 +375,197 @@ def analyze_position(board: chess.Board, move_history: list[str]) -> dict:
     }
 
 
-def render_board_png(board: chess.Board) -> BytesIO:
-    """Render a PNG chessboard image using python-chess SVG + cairosvg."""
-    last_move = board.move_stack[-1] if board.move_stack else None
-    svg = chess.svg.board(board=board, size=720, lastmove=last_move)
-    png_bytes = cairosvg.svg2png(bytestring=svg.encode("utf-8"))
+def analyze_position(board: chess.Board, move_history: Callable[[], list[str]],
+                     engine: Optional[chess.engine.SimpleEngine] = None) -> dict:
+    """Analyze board and return normalized analysis fields.
+
+    With an engine the fields come from a local Stockfish search; OpenAI, whose
+    explanation the bot never shows, is only asked when there is no engine line.
+    ``move_history`` returns the SAN moves and is only called for that OpenAI
+    prompt, since building them replays the whole game."""
+    analysis = _local_analysis(board, engine)
+    if analysis is not None:
+        return analysis
+
+    side_to_move = "White" if board.turn == chess.WHITE else "Black"
+    # UCI needs no SAN disambiguation pass per move, and the model reads it fine
+    legal_moves = " ".join(m.uci() for m in board.legal_moves)
+
+    user_message = (
+        f"Position (FEN): {board.fen()}\n"
+        f"It is {side_to_move}'s turn to move. Suggest the best move for {side_to_move}."
+    )
+    user_message += f"\nLegal moves: {legal_moves}"
+    user_message += "\nIMPORTANT: You MUST recommend one of the legal moves listed above."
+    history = move_history()
+    if history:
+        user_message += f"\nMove history: {' '.join(history)}"
+
+    parsed = _stream_analysis([
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": user_message},
+    ])
+
+    analysis = _normalize_analysis(parsed)
+    cache_put(_analysis_cache, board._transposition_key(), analysis)
+    return dict(analysis)
+
+
+def analyze_positions(boards: list[chess.Board], move_histories: list[Callable[[], list[str]]],
+                      engine: Optional[chess.engine.SimpleEngine] = None) -> list[dict]:
+    """analyze_position for several positions. Cache hits and engine lines are used
+    as usual; whatever is left goes to OpenAI in a single request."""
+    results = [_local_analysis(board, engine) for board in boards]
+    pending = [i for i, analysis in enumerate(results) if analysis is None]
+    if len(pending) == 1:
+        i = pending[0]
+        results[i] = analyze_position(boards[i], move_histories[i])
+    elif pending:
+        positions = [
+            {
+                "fen": boards[i].fen(),
+                "legalMoves": [m.uci() for m in boards[i].legal_moves],
+                "history": move_histories[i](),
+            }
+            for i in pending
+        ]
+        user_message = (
+            "Analyze each of these positions on its own, for the side to move in it. "
+            'Respond with a JSON object {"analyses": [...]} holding one object with the '
+            "keys above per position, in the same order. Only recommend moves from each "
+            "position's legalMoves.\n"
+            f"Positions: {orjson.dumps(positions).decode()}"
+        )
+        with _openai_slots:
+            response = client.chat.completions.create(
+                model=OPENAI_MODEL,
+                messages=[
+                    {"role": "system", "content": SYSTEM_PROMPT},
+                    {"role": "user", "content": user_message},
+                ],
+                max_tokens=ANALYSIS_MAX_TOKENS * len(pending),
+                response_format={"type": "json_object"},
+            )
+        analyses = orjson.loads(response.choices[0].message.content).get("analyses", [])
+        for i, parsed in zip(pending, analyses):
+            results[i] = _normalize_analysis(parsed)
+            cache_put(_analysis_cache, boards[i]._transposition_key(), results[i])
+        # Anything the model left out is asked for on its own
+        for i in pending[len(analyses):]:
+            results[i] = analyze_position(boards[i], move_histories[i])
+    return results
+
+
+# Board images are composited with Pillow: the python-chess piece SVGs are
+# rasterized once at import, and each render pastes them onto a prebuilt board.
+SQUARE_PX = 84
+MARGIN_PX = 24  # coordinate border; 8 * 84 + 2 * 24 = 720
+BOARD_PX = 8 * SQUARE_PX + 2 * MARGIN_PX
+_COLORS = chess.svg.DEFAULT_COLORS
+
+
+def _square_origin(square: chess.Square) -> tuple[int, int]:
+    return (MARGIN_PX + chess.square_file(square) * SQUARE_PX,
+            MARGIN_PX + (7 - chess.square_rank(square)) * SQUARE_PX)
+
+
+def _square_color(square: chess.Square, kind: str) -> str:
+    light = (chess.square_file(square) + chess.square_rank(square)) % 2
+    return _COLORS[f"square {'light' if light else 'dark'}{kind}"]
+
+
+def _build_background() -> Image.Image:
+    image = Image.new("RGB", (BOARD_PX, BOARD_PX), _COLORS["margin"])
+    draw = ImageDraw.Draw(image)
+    for square in chess.SQUARES:
+        x, y = _square_origin(square)
+        draw.rectangle((x, y, x + SQUARE_PX - 1, y + SQUARE_PX - 1), fill=_square_color(square, ""))
+    try:
+        font = ImageFont.load_default(size=16)
+    except TypeError:  # Pillow < 10.1
+        font = ImageFont.load_default()
+    for i in range(8):
+        center = MARGIN_PX + i * SQUARE_PX + SQUARE_PX // 2
+        for edge in (MARGIN_PX // 2, BOARD_PX - MARGIN_PX // 2):
+            draw.text((center, edge), chess.FILE_NAMES[i], fill=_COLORS["coord"], font=font, anchor="mm")
+            draw.text((edge, center), chess.RANK_NAMES[7 - i], fill=_COLORS["coord"], font=font, anchor="mm")
+    return image
+
+
+def _build_sprites() -> dict[str, Image.Image]:
+    sprites = {}
+    for symbol in "PNBRQKpnbrqk":
+        svg = chess.svg.piece(chess.Piece.from_symbol(symbol), size=SQUARE_PX)
+        sprites[symbol] = Image.open(BytesIO(cairosvg.svg2png(bytestring=svg.encode("utf-8")))).convert("RGBA")
+    return sprites
+
+
+def _build_check_glow() -> Image.Image:
+    # Red fading towards the square's edge, like the SVG renderer's check marker
+    alpha = Image.radial_gradient("L").resize((SQUARE_PX, SQUARE_PX)).point(lambda v: max(0, 255 - v))
+    glow = Image.new("RGBA", (SQUARE_PX, SQUARE_PX), (255, 0, 0, 0))
+    glow.putalpha(alpha)
+    return glow
+
+
+BOARD_BACKGROUND = _build_background()
+PIECE_SPRITES = _build_sprites()
+CHECK_GLOW = _build_check_glow()
+
+
+def _render_png(board_fen: str, turn: chess.Color, last_move_uci: str) -> bytes:
+    """Render worker (runs in RENDER_POOL). The picture depends only on placement,
+    the side to move (check highlight) and the last move."""
+    board = chess.Board(None)
+    board.set_board_fen(board_fen)
+    board.turn = turn
+
+    image = BOARD_BACKGROUND.copy()
+    if last_move_uci:
+        move = chess.Move.from_uci(last_move_uci)
+        draw = ImageDraw.Draw(image)
+        for square in (move.from_square, move.to_square):
+            x, y = _square_origin(square)
+            draw.rectangle((x, y, x + SQUARE_PX - 1, y + SQUARE_PX - 1), fill=_square_color(square, " lastmove"))
+    if board.is_check():
+        glow_at = _square_origin(board.king(turn))
+        image.paste(CHECK_GLOW, glow_at, CHECK_GLOW)
+    for square, piece in board.piece_map().items():
+        sprite = PIECE_SPRITES[piece.symbol()]
+        image.paste(sprite, _square_origin(square), sprite)
+
+    out = BytesIO()
+    image.save(out, "PNG", compress_level=1)
+    return out.getvalue()
+
+
+# Rendering is CPU-bound, so it runs in worker processes rather than threads;
+# finished PNGs are cached here by _render_png's arguments
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", str(max(2, (os.cpu_count() or 2) // 2))))
+_render_pool = None
+_png_cache = LRUCache(maxsize=2048)
+
+
+def get_render_pool() -> ProcessPoolExecutor:
+    global _render_pool
+    if _render_pool is None:
+        # Forking after the event loop and to_thread workers exist can copy locks
+        # held by those threads, so workers start from a clean interpreter
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        _render_pool = ProcessPoolExecutor(max_workers=RENDER_WORKERS, mp_context=context)
+    return _render_pool
+
+
+async def render_board_png(board: chess.Board) -> BytesIO:
+    """Render a PNG chessboard image by pasting piece sprites with Pillow."""
+    last_move = board.move_stack[-1].uci() if board.move_stack else ""
+    key = (board.board_fen(), board.turn, last_move)
+    png_bytes = _png_cache.get(key)
+    if png_bytes is None:
+        loop = asyncio.get_running_loop()
+        png_bytes = await loop.run_in_executor(get_render_pool(), _render_png, *key)
+        _png_cache[key] = png_bytes
 
     image = BytesIO(png_bytes)
     image.name = "board.png"
@@ -182,7 +584,12 @@ def format_analysis(analysis: dict) -> str:
 
 async def send_board(update: Update, board: chess.Board, caption: str) -> None:
     """Send board PNG as Telegram photo."""
-    image = await asyncio.to_thread(render_board_png, board)
+    image = await render_board_png(board)
+    await send_image(update, image, caption)
+
+
+async def send_image(update: Update, image: BytesIO, caption: str) -> None:
+    """Send an already rendered board PNG as Telegram photo."""
     await update.effective_chat.send_photo(photo=InputFile(image), caption=caption)
 
 
@@ -192,39 +599,48 @@ async def cmd_help(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         "/start or /newgame - Start a game (Stockfish plays White first)\n"
         "/move <move> - Play your move (SAN like Nf6 or UCI like e7e5)\n"
         "/board - Show current board\n"
-        "/analyze - Analyze the current position\n"
+        f"/analyze [n] - Analyze the current position (or the last n, up to {ANALYZE_MAX_POSITIONS})\n"
         "/resign - Resign the current game\n"
         "/help - Show this help"
     )
     await update.message.reply_text(text)
 
 
+@one_at_a_time
 async def cmd_newgame(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     chat_id = update.effective_chat.id
+    await asyncio.to_thread(close_engine, GAMES.pop(chat_id, None))
     game = ChatGame()
 
     try:
-        sf_move, sf_san = await asyncio.to_thread(stockfish_best_move, game.board)
+        sf_move, sf_san = await asyncio.to_thread(stockfish_best_move, game)
         if not sf_move:
             await update.message.reply_text("Could not start game: Stockfish failed to return a move.")
             return
 
-        game.board.push(sf_move)
-        game.history.append(sf_san)
+        game.push(sf_move)
 
-        analysis = await asyncio.to_thread(analyze_position, game.board, game.history)
+        analysis, image = await asyncio.gather(
+            asyncio.to_thread(analyze_game, game),
+            render_board_png(game.board),
+        )
         GAMES[chat_id] = game
 
         caption = (
             f"New game started. Stockfish (White) played: {sf_san}\n\n"
             f"{format_analysis(analysis)}"
         )
-        await send_board(update, game.board, caption)
+        await send_image(update, image, caption)
     except Exception as exc:
         logger.exception("Failed to start new game")
         await update.message.reply_text(f"Failed to start game: {exc}")
+    finally:
+        # A game that never got registered would otherwise orphan its engine
+        if GAMES.get(chat_id) is not game:
+            await asyncio.to_thread(close_engine, game)
 
 
+@one_at_a_time
 async def cmd_move(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     chat_id = update.effective_chat.id
     game = GAMES.get(chat_id)
@@ -248,13 +664,13 @@ async def cmd_move(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         return
 
     human_san = game.board.san(move)
-    game.board.push(move)
-    game.history.append(human_san)
+    game.push(move)
 
     over, status_text, win_chance = check_game_over(game.board)
     if over:
         game.status = "game_over"
         game.result = game.board.result(claim_draw=True)
+        await asyncio.to_thread(close_engine, game)
         terminal_analysis = {
             "bestMove": "N/A",
             "evaluation": status_text,
@@ -269,14 +685,15 @@ async def cmd_move(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         return
 
     try:
-        sf_move, sf_san = await asyncio.to_thread(stockfish_best_move, game.board)
+        sf_move, sf_san = await asyncio.to_thread(stockfish_best_move, game)
         if not sf_move:
             await update.message.reply_text("Stockfish could not find a reply move.")
             return
 
-        game.board.push(sf_move)
-        game.history.append(sf_san)
+        game.push(sf_move)
 
+        # The board is rendered while the position is analyzed
+        render = render_board_png(game.board)
         over, status_text, win_chance = check_game_over(game.board)
         if over:
             game.status = "game_over"
@@ -286,20 +703,22 @@ async def cmd_move(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
                 "evaluation": status_text,
                 "winChance": win_chance,
             }
+            image, _ = await asyncio.gather(render, asyncio.to_thread(close_engine, game))
         else:
-            analysis = await asyncio.to_thread(analyze_position, game.board, game.history)
+            analysis, image = await asyncio.gather(asyncio.to_thread(analyze_game, game), render)
 
         caption = (
             f"You played: {human_san}\n"
             f"Stockfish played: {sf_san}\n\n"
             f"{format_analysis(analysis)}"
         )
-        await send_board(update, game.board, caption)
+        await send_image(update, image, caption)
     except Exception as exc:
         logger.exception("Move handling failed")
         await update.message.reply_text(f"Move failed: {exc}")
 
 
+@one_at_a_time
 async def cmd_board(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     chat_id = update.effective_chat.id
     game = GAMES.get(chat_id)
@@ -307,7 +726,11 @@ async def cmd_board(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         await update.message.reply_text("No active game. Use /newgame to start one.")
         return
 
-    move_text = game.history[-1] if game.history else "None"
+    move_text = "None"
+    if game.board.move_stack:
+        board = game.board.copy()
+        move = board.pop()
+        move_text = board.san(move)
     status = "Active" if game.status == "active" else f"Over ({game.result or game.status})"
     caption = f"Current board\nLast move: {move_text}\nStatus: {status}"
 
@@ -318,6 +741,7 @@ async def cmd_board(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         await update.message.reply_text(f"Could not render board: {exc}")
 
 
+@one_at_a_time
 async def cmd_analyze(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     chat_id = update.effective_chat.id
     game = GAMES.get(chat_id)
@@ -325,6 +749,24 @@ async def cmd_analyze(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         await update.message.reply_text("No active game. Use /newgame to start one.")
         return
 
+    count = 1
+    if context.args:
+        try:
+            count = max(1, min(ANALYZE_MAX_POSITIONS, int(context.args[0])))
+        except ValueError:
+            await update.message.reply_text(f"Usage: /analyze [n] (n up to {ANALYZE_MAX_POSITIONS})")
+            return
+
+    if count > 1:
+        try:
+            results = await asyncio.to_thread(analyze_recent, game, count)
+            text = "\n\n".join(f"{label}\n{format_analysis(analysis)}" for label, analysis in results)
+            await update.message.reply_text(text or "Nothing to analyze.")
+        except Exception as exc:
+            logger.exception("Analysis failed")
+            await update.message.reply_text(f"Analysis failed: {exc}")
+        return
+
     over, status_text, win_chance = check_game_over(game.board)
     if over:
         analysis = {
@@ -336,13 +778,14 @@ async def cmd_analyze(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         return
 
     try:
-        analysis = await asyncio.to_thread(analyze_position, game.board, game.history)
+        analysis = await asyncio.to_thread(analyze_game, game)
         await update.message.reply_text(format_analysis(analysis))
     except Exception as exc:
         logger.exception("Analysis failed")
         await update.message.reply_text(f"Analysis failed: {exc}")
 
 
+@one_at_a_time
 async def cmd_resign(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     chat_id = update.effective_chat.id
     game = GAMES.get(chat_id)
@@ -356,6 +799,7 @@ async def cmd_resign(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
 
     game.status = "resigned"
     game.result = "1-0"
+    await asyncio.to_thread(close_engine, game)
     await update.message.reply_text("You resigned. Stockfish (White) wins. Use /newgame for a rematch.")
 
 
@@ -365,12 +809,25 @@ async def on_error(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
         await update.effective_message.reply_text("Unexpected error occurred. Please try again.")
 
 
+async def on_shutdown(application: Application) -> None:
+    for game in GAMES.values():
+        await asyncio.to_thread(close_engine, game)
+    if _render_pool is not None:
+        _render_pool.shutdown(cancel_futures=True)
+
+
 def main() -> None:
     token = os.getenv("TELEGRAM_BOT_TOKEN")
     if not token:
         raise RuntimeError("TELEGRAM_BOT_TOKEN is required")
 
-    application = Application.builder().token(token).build()
+    application = (
+        Application.builder()
+        .token(token)
+        .concurrent_updates(True)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
 
     application.add_handler(CommandHandler(["start", "newgame"], cmd_newgame))
     application.add_handler(CommandHandler("move", cmd_move))